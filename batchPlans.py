@@ -0,0 +1,278 @@
+"""
+Batch plan generation for a roster: every athlete of a directory is simulated in a process
+pool and their plan written in the chosen export format.
+
+The input directory holds one history per athlete (<athlete>.csv) and/or a config per athlete
+(<athlete>.json). An optional shared config.json gives the plan start_date and end_date to
+every athlete; an athlete's own JSON overrides its keys. Athletes with a history are planned
+from it; athletes with only a config are planned from the config values, as a 'config'
+request to /generate_plan is.
+
+Athletes whose inputs are unchanged since the last run are skipped, see MANIFEST_FILENAME.
+Histories are parsed once: a pre-parsed sidecar of each CSV is cached in the output directory
+(see RUN_CACHE_DIRNAME) and memory-mapped on later runs; the input directory is only read.
+
+    python batchPlans.py roster/ -o plans/                  # CSV plans, one file per athlete
+    python batchPlans.py roster/ -o plans/ -f parquet -j 8  # Parquet with 8 worker processes
+    python batchPlans.py roster/ -o plans/ --force          # redo every athlete
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict
+from datetime import datetime
+
+from calibration import CALIBRATION_FOLDER, CalibrationStore
+from fitnessState import ATHLETE_ID_PATTERN
+from planExport import EXPORT_FORMATS, export_rows, iter_plan_rows
+from simulateRunPlan import (GENERAL_CONFIG_FILENAME, calculate_num_weeks, get_current_week,
+                             load_historical_runs_file, load_physiology_config, run_table_sidecar_paths,
+                             simulate_training_plan)
+
+SHARED_CONFIG_FILENAME = 'config.json'
+
+# Suffixes of pre-parsed sidecars of histories (see save_run_table_sidecar), not athletes themselves
+SIDECAR_SUFFIXES = run_table_sidecar_paths('')
+
+# Subdirectory of the output directory caching the pre-parsed sidecars of the histories
+RUN_CACHE_DIRNAME = '.run_cache'
+
+# Written to the output directory: athlete -> fingerprint of the inputs of its last written plan
+MANIFEST_FILENAME = '.plan_manifest.json'
+
+CONFIG_FIELDS = ('initial_atl', 'initial_ctl', 'long_run_duration', 'tempo_run_duration', 'long_run_pace',
+                 'tempo_run_pace')
+
+
+def find_athletes(input_dir):
+    """
+    Returns:
+    dict: athlete_id -> (history CSV path or None, config JSON path or None), sorted by id.
+    """
+    athletes = {}
+    for filename in sorted(os.listdir(input_dir)):
+        athlete_id, extension = os.path.splitext(filename)
+        if (extension not in ('.csv', '.json') or filename == SHARED_CONFIG_FILENAME or
+                filename.endswith(SIDECAR_SUFFIXES)):
+            continue
+        history, config = athletes.get(athlete_id, (None, None))
+        path = os.path.join(input_dir, filename)
+        athletes[athlete_id] = (path, config) if extension == '.csv' else (history, path)
+    return athletes
+
+
+def read_json(filename):
+    with open(filename, 'r', encoding='utf-8-sig') as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f"{filename} must hold a JSON object.")
+    return config
+
+
+def plan_config(config, historical):
+    """
+    Type-cast a merged athlete config the way /generate_plan does.
+    Histories only need the plan dates; config plans also need the starting fitness and runs.
+    """
+    for key in ('start_date', 'end_date'):
+        if key not in config:
+            raise ValueError(f"Missing {key}, set it in {SHARED_CONFIG_FILENAME} or the athlete's config.")
+    user_params = {
+        'start_date': datetime.strptime(config['start_date'], '%Y-%m-%d'),
+        'end_date': datetime.strptime(config['end_date'], '%Y-%m-%d'),
+    }
+    user_params['num_weeks'] = calculate_num_weeks(user_params['start_date'], user_params['end_date'])
+    if not historical:
+        user_params.update({key: float(config.get(key, 0)) for key in CONFIG_FIELDS})
+    return user_params
+
+
+def input_fingerprint(history_path, config, physiology, coefficients, export_format):
+    """
+    SHA-256 of everything a plan depends on: the history bytes, the merged config, the general
+    config, the athlete's calibrated coefficients, the export format, the current week of the
+    plan and the calendar week (plans start from the current week and fold the runs before this
+    calendar week into the starting fitness, so they change as the weeks go by, as plan_key's do).
+    """
+    digest = hashlib.sha256()
+    if history_path is not None:
+        with open(history_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    current_week = get_current_week(config['start_date']) if 'start_date' in config else None
+    digest.update(json.dumps({
+        'config': config,
+        'physiology': asdict(physiology),
+        'coefficients': asdict(coefficients) if coefficients is not None else None,
+        'format': export_format,
+        'current_week': current_week,
+        'iso_week': datetime.now().isocalendar()[:2],
+    }, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILENAME), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_FILENAME)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def write_athlete_plan(athlete_id, history_path, config, physiology, coefficients, output_path, export_format,
+                       sidecar=None):
+    """
+    Simulate one athlete and write the plan to output_path, in a worker process.
+    The parsed history is cached under the path sidecar (see load_historical_runs_file).
+    The file is written under a temporary name and renamed, so a failed run never leaves a partial plan.
+
+    Returns:
+    int: The number of sessions written.
+    """
+    user_params = plan_config(config, history_path is not None)
+    if history_path is not None:
+        runs = load_historical_runs_file(history_path, as_table=True, sidecar=sidecar)
+        training_plan = simulate_training_plan(user_params, runs, physiology, log_weeks=False,
+                                               coefficients=coefficients)
+        # Historical plans are dated from their first week, as server.build_plan does
+        start_date = training_plan[0]['week_sunday']
+    else:
+        training_plan = simulate_training_plan(user_params, physiology=physiology, log_weeks=False,
+                                               coefficients=coefficients)
+        start_date = user_params['start_date']
+
+    sessions = 0
+
+    def counted(rows):
+        nonlocal sessions
+        for row in rows:
+            sessions += 1
+            yield row
+
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    rows = counted(iter_plan_rows(training_plan, start_date, athlete_id))
+    try:
+        with open(temp_path, 'wb') as f:
+            for chunk in export_rows(rows, export_format):
+                f.write(chunk.encode() if isinstance(chunk, str) else chunk)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return sessions
+
+
+def report_progress(done, total, failed, skipped):
+    # One updating line on a terminal, one line per plan when logged to a file
+    end = '\r' if sys.stderr.isatty() else '\n'
+    print(f"{done}/{total} athletes planned, {failed} failed, {skipped} unchanged", end=end, file=sys.stderr,
+          flush=True)
+
+
+def run_batch(input_dir, output_dir, export_format='csv', workers=None, force=False,
+              physiology_file=GENERAL_CONFIG_FILENAME, calibration_folder=CALIBRATION_FOLDER):
+    """
+    Write the plan of every athlete of input_dir to output_dir/<athlete>.<extension>.
+
+    Returns:
+    dict: Counts of 'written', 'skipped' and 'failed' athletes, and the failures as athlete_id -> error.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    extension = EXPORT_FORMATS[export_format][1]
+    cache_dir = os.path.join(output_dir, RUN_CACHE_DIRNAME)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    shared_path = os.path.join(input_dir, SHARED_CONFIG_FILENAME)
+    shared_config = read_json(shared_path) if os.path.exists(shared_path) else {}
+    physiology = load_physiology_config(physiology_file)
+    calibration_store = CalibrationStore(calibration_folder)
+    manifest = {} if force else load_manifest(output_dir)
+
+    failures = {}
+    tasks = {}
+    skipped = 0
+    for athlete_id, (history_path, config_path) in find_athletes(input_dir).items():
+        try:
+            config = dict(shared_config)
+            if config_path is not None:
+                config.update(read_json(config_path))
+            coefficients = calibration_store.get(athlete_id) if ATHLETE_ID_PATTERN.match(athlete_id) else None
+            fingerprint = input_fingerprint(history_path, config, physiology, coefficients, export_format)
+        except (OSError, ValueError) as e:
+            failures[athlete_id] = str(e)
+            continue
+        output_path = os.path.join(output_dir, f"{athlete_id}.{extension}")
+        if manifest.get(athlete_id) == fingerprint and os.path.exists(output_path):
+            skipped += 1
+            continue
+        tasks[athlete_id] = (fingerprint, (athlete_id, history_path, config, physiology, coefficients,
+                                           output_path, export_format,
+                                           os.path.join(cache_dir, f"{athlete_id}.csv")))
+
+    total = len(tasks) + len(failures)
+    written = 0
+    try:
+        if tasks:
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+                futures = {executor.submit(write_athlete_plan, *args): athlete_id
+                           for athlete_id, (_, args) in tasks.items()}
+                for future in as_completed(futures):
+                    athlete_id = futures[future]
+                    try:
+                        future.result()
+                        manifest[athlete_id] = tasks[athlete_id][0]
+                        written += 1
+                    except Exception as e:
+                        manifest.pop(athlete_id, None)
+                        failures[athlete_id] = str(e)
+                    report_progress(written + len(failures), total, len(failures), skipped)
+            if sys.stderr.isatty():
+                print(file=sys.stderr)
+    finally:
+        # Kept even when interrupted, so the plans written so far are not redone
+        save_manifest(output_dir, manifest)
+
+    return {'written': written, 'skipped': skipped, 'failed': len(failures), 'failures': failures}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the training plans of a directory of athletes.")
+    parser.add_argument('input_dir', help="Directory of <athlete>.csv histories and <athlete>.json configs.")
+    parser.add_argument('-o', '--output-dir', default='plans', help="Directory the plans are written to.")
+    parser.add_argument('-f', '--format', default='csv', choices=sorted(EXPORT_FORMATS), help="Plan file format.")
+    parser.add_argument('-j', '--workers', type=int, help="Worker processes, all cores by default.")
+    parser.add_argument('--force', action='store_true', help="Redo athletes whose inputs have not changed.")
+    parser.add_argument('--physiology', default=GENERAL_CONFIG_FILENAME, help="General config file.")
+    parser.add_argument('--calibrations', default=CALIBRATION_FOLDER,
+                        help="Folder of calibrated pace coefficients (see /calibrate).")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        summary = run_batch(args.input_dir, args.output_dir, args.format, args.workers, args.force,
+                            args.physiology, args.calibrations)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    for athlete_id, error in sorted(summary['failures'].items()):
+        print(f"FAILED {athlete_id}: {error}", file=sys.stderr)
+    print(f"{summary['written']} plans written, {summary['skipped']} unchanged, {summary['failed']} failed "
+          f"in {time.perf_counter() - started:.1f} s.")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""
+Benchmarks for the hot paths of the planner: history parsing, fitness replay, plan simulation,
+adding history to the plan, formatting and the /generate_plan route.
+
+Histories and plans come from deterministic generators, so runs on the same machine compare.
+Timings are the best and median of several repeats; peak memory is measured separately with
+tracemalloc (NumPy reports its buffers to it).
+
+    python benchmark.py                      # run and print the table
+    python benchmark.py --quick              # small scenarios only
+    python benchmark.py --save-baseline      # store the results as the baseline
+    python benchmark.py --compare            # flag stages slower than the baseline
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from simulateRunPlan import (add_historical_runs_to_plan, calculate_fitness_from_history, format_results,
+                             get_current_week, load_historic_runs, load_historical_runs_memory,
+                             load_historical_runs_table, simulate_training_plan, week_checkpoints)
+
+BASELINE_FILENAME = 'benchmark_baseline.json'
+
+HISTORY_SIZES = (10, 1000, 10000, 100000)  # Runs per generated history
+PLAN_HORIZONS = (4, 20, 200)  # Weeks per generated plan
+QUICK_HISTORY_SIZES = (10, 1000)
+QUICK_PLAN_HORIZONS = (4, 20)
+
+REGRESSION_THRESHOLD = 1.25  # A stage is flagged when its best time grows by more than this factor
+
+RUN_TYPES = ('long_run', 'tempo_run_1', 'tempo_run_2')
+
+
+def generate_history_csv(num_runs, seed=0, end_date=None):
+    """
+    Generate a historical runs CSV with num_runs runs ending the day before end_date.
+    The same num_runs and seed give the same runs, dated relative to end_date.
+    """
+    rng = np.random.default_rng(seed)
+    if end_date is None:
+        end_date = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    span_days = max(28, num_runs // 2)
+    days_back = np.sort(rng.integers(1, span_days + 1, num_runs))[::-1]
+    duration = rng.uniform(20, 120, num_runs)
+    pace = rng.uniform(4.5, 7.5, num_runs)
+    avg_hr = rng.integers(120, 176, num_runs)
+    avg_power = rng.integers(150, 281, num_runs)
+    vo2max = rng.uniform(30, 55, num_runs)
+    trimp = duration * rng.uniform(0.8, 2.0, num_runs)
+    run_type = rng.integers(0, len(RUN_TYPES), num_runs)
+
+    rows = ['date,duration,avg_power,pace,trimp,vo2max,distance,avg_hr,run_type']
+    for i in range(num_runs):
+        date = end_date - timedelta(days=int(days_back[i]))
+        seconds = int(duration[i] * 60)
+        pace_seconds = int(pace[i] * 60)
+        rows.append(f"{date:%Y-%m-%d},{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d},"
+                    f"{avg_power[i]},{pace_seconds // 60}:{pace_seconds % 60:02d},{trimp[i]:.0f},"
+                    f"{vo2max[i]:.2f},{duration[i] / pace[i]:.2f},{avg_hr[i]},{RUN_TYPES[run_type[i]]}")
+    return '\n'.join(rows) + '\n'
+
+
+def generate_plan_dates(num_weeks):
+    """
+    Plan dates for a horizon of num_weeks, a quarter of it already behind us so
+    add_historical_runs_to_plan has past weeks to fill.
+
+    Returns:
+    tuple: start_date and end_date as datetime objects.
+    """
+    today = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+    start_date = today - timedelta(weeks=num_weeks // 4)
+    end_date = start_date + timedelta(weeks=num_weeks, days=-1)
+    return start_date, end_date
+
+
+def measure(func, repeats):
+    """
+    Returns:
+    dict: Best and median wall time in milliseconds and the tracemalloc peak in KiB of func().
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'best_ms': round(min(times), 3), 'median_ms': round(statistics.median(times), 3),
+            'peak_kib': round(peak / 1024, 1)}
+
+
+def benchmark_scenario(num_runs, num_weeks, repeats, client, server_caches):
+    """
+    Time every stage for one history size and plan horizon.
+
+    Returns:
+    dict: Stage name -> measurement, see measure.
+    """
+    csv_data = generate_history_csv(num_runs)
+    start_date, end_date = generate_plan_dates(num_weeks)
+    user_params = {'start_date': start_date, 'end_date': end_date, 'num_weeks': num_weeks}
+    runs = load_historical_runs_table(csv_data)
+    config, _ = load_historic_runs(user_params, runs)
+    current_week = get_current_week(start_date)
+
+    simulated = simulate_training_plan(config)
+    planned = [entry for entry in simulated if entry['week'] >= current_week]
+    training_plan = simulate_training_plan(user_params, runs)
+
+    def add_history():
+        # add_historical_runs_to_plan appends to the week lists, so give it fresh ones
+        plan = [dict(entry, plan=list(entry['plan'])) for entry in planned]
+        add_historical_runs_to_plan(plan, start_date, current_week, runs)
+
+    payload = {'type': 'historical', 'csv': csv_data, 'start_date': f"{start_date:%Y-%m-%d}",
+               'end_date': f"{end_date:%Y-%m-%d}"}
+
+    def generate_plan_route():
+        # Cold route: nothing rendered, simulated or checkpointed before
+        for cache in server_caches:
+            cache.clear()
+        week_checkpoints.clear()
+        response = client.post('/generate_plan', json=payload)
+        if response.status_code != 200:
+            raise RuntimeError(f"/generate_plan returned {response.status_code}: {response.get_data(as_text=True)}")
+
+    stages = {
+        'load_historical_runs_memory': lambda: load_historical_runs_memory(csv_data),
+        'load_historical_runs_table': lambda: load_historical_runs_table(csv_data),
+        'calculate_fitness_from_history': lambda: calculate_fitness_from_history(runs),
+        'simulate_training_plan': lambda: simulate_training_plan(config, reuse_weeks=False),
+        'add_historical_runs_to_plan': add_history,
+        'format_results': lambda: format_results(training_plan, training_plan[0]['week_sunday']),
+        'generate_plan_route': generate_plan_route,
+    }
+    return {name: measure(func, repeats) for name, func in stages.items()}
+
+
+def run_benchmarks(history_sizes, plan_horizons, repeats):
+    # Imported here so the library stages can be benchmarked without creating the app
+    from server import app, plan_cache, simulation_cache, week_fragment_cache
+    client = app.test_client()
+    server_caches = (plan_cache, week_fragment_cache, simulation_cache)
+
+    results = {}
+    for num_runs in history_sizes:
+        for num_weeks in plan_horizons:
+            scenario = f"{num_runs}runs_{num_weeks}weeks"
+            results[scenario] = benchmark_scenario(num_runs, num_weeks, repeats, client, server_caches)
+    return results
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'date': datetime.now().strftime('%Y-%m-%d %H:%M')}
+
+
+def compare_to_baseline(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Returns:
+    list: (scenario, stage, baseline best_ms, best_ms) for every stage slower than threshold times the baseline.
+    """
+    regressions = []
+    for scenario, stages in results.items():
+        for stage, measurement in stages.items():
+            previous = baseline.get('results', {}).get(scenario, {}).get(stage)
+            if previous and measurement['best_ms'] > previous['best_ms'] * threshold:
+                regressions.append((scenario, stage, previous['best_ms'], measurement['best_ms']))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print(f"{'scenario':<22} {'stage':<32} {'best ms':>10} {'median ms':>10} {'peak KiB':>10} {'vs base':>8}")
+    for scenario, stages in results.items():
+        for stage, measurement in stages.items():
+            ratio = ''
+            previous = (baseline or {}).get('results', {}).get(scenario, {}).get(stage)
+            if previous and previous['best_ms'] > 0:
+                ratio = f"{measurement['best_ms'] / previous['best_ms']:.2f}x"
+            print(f"{scenario:<22} {stage:<32} {measurement['best_ms']:>10.3f} {measurement['median_ms']:>10.3f} "
+                  f"{measurement['peak_kib']:>10.1f} {ratio:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the training plan hot paths.")
+    parser.add_argument('--quick', action='store_true', help="Run the small scenarios only.")
+    parser.add_argument('--runs', type=int, nargs='+', help="History sizes to run (number of runs).")
+    parser.add_argument('--weeks', type=int, nargs='+', help="Plan horizons to run (number of weeks).")
+    parser.add_argument('--repeats', type=int, default=5, help="Timed repeats per stage.")
+    parser.add_argument('--baseline', default=BASELINE_FILENAME, help="Baseline file to save to or compare with.")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the baseline.")
+    parser.add_argument('--compare', action='store_true',
+                        help="Exit with status 1 when a stage is slower than the baseline.")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="Slowdown factor counted as a regression.")
+    args = parser.parse_args(argv)
+
+    history_sizes = args.runs or (QUICK_HISTORY_SIZES if args.quick else HISTORY_SIZES)
+    plan_horizons = args.weeks or (QUICK_PLAN_HORIZONS if args.quick else PLAN_HORIZONS)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    results = run_benchmarks(history_sizes, plan_horizons, args.repeats)
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+        print(f"Baseline saved to {args.baseline}.")
+
+    if args.compare:
+        if baseline is None:
+            print(f"No baseline at {args.baseline}, run with --save-baseline first.")
+            return 1
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        for scenario, stage, previous_ms, best_ms in regressions:
+            print(f"REGRESSION {scenario} {stage}: {previous_ms:.3f} ms -> {best_ms:.3f} ms")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import itertools
+import json
+import os
+import threading
+from dataclasses import asdict, fields
+
+import numpy as np
+
+from fitnessState import ATHLETE_ID_PATTERN
+from simulateRunPlan import (DEFAULT_PACE_COEFFICIENTS, DEFAULT_PHYSIOLOGY, PaceCoefficients, as_run_table,
+                             fitness_series)
+
+CALIBRATION_FOLDER = 'calibrations'  # Folder where the per-athlete fitted coefficients are stored
+
+COEFFICIENT_NAMES = [field.name for field in fields(PaceCoefficients)]
+
+# Sensitivities are fitted with a lower bound of 0, so fitness never slows the pace down; the intercept is free
+LOWER_BOUNDED = np.array([name != 'k0' for name in COEFFICIENT_NAMES])
+
+# Pull towards the default coefficients; keeps short or flat histories close to the defaults
+CALIBRATION_RIDGE = 1.0
+MIN_CALIBRATION_RUNS = 10  # Athletes with fewer usable runs keep the defaults
+
+
+def calibration_rows(historical_runs, physiology=DEFAULT_PHYSIOLOGY):
+    """
+    Regression rows of one history, one per run that follows an earlier run of the same type.
+    The target is the pace change estimate_pace_trimp predicts from the previous pace:
+    pace - last_pace = -k1 * ctl / 50 + k2 * atl / 50 + k3 * trimp / 100 - k5 * power / 100 - k6 * (hr - rest) + k0
+    with ATL and CTL as they were before the run. Power and heart rate barely vary, so without
+    the intercept k0 they would stand in for one and cancel each other out.
+
+    Returns:
+    tuple: Features (n, 6) in COEFFICIENT_NAMES order and targets (n,).
+    """
+    runs = as_run_table(historical_runs)
+    atl, ctl, _ = fitness_series(runs.trimp)
+    atl_before = np.concatenate([[0.0], atl[:-1]])
+    ctl_before = np.concatenate([[0.0], ctl[:-1]])
+
+    # Previous run of the same type, in file order
+    order = np.lexsort((np.arange(len(runs)), runs.run_type_codes))
+    has_previous = np.zeros(len(runs), dtype=bool)
+    has_previous[1:] = runs.run_type_codes[order][1:] == runs.run_type_codes[order][:-1]
+    current, previous = order[has_previous], order[np.flatnonzero(has_previous) - 1]
+
+    features = np.column_stack([
+        -ctl_before[current] / 50,
+        atl_before[current] / 50,
+        runs.trimp[current] / 100,
+        -runs.avg_power[current] / 100,
+        -(runs.avg_hr[current] - physiology.resting_heart_rate),
+        np.ones(len(current)),
+    ])
+    targets = runs.pace[current] - runs.pace[previous]
+    usable = np.isfinite(features).all(axis=1) & np.isfinite(targets)
+    return features[usable], targets[usable]
+
+
+def bounded_ridge_solve(gram, moment, lower_bounded=LOWER_BOUNDED):
+    """
+    Minimize x'Gx / 2 - m'x for every athlete's (G, m) with x >= 0 where lower_bounded.
+    The optimum is the unconstrained optimum of one face, a subset of the bounded coefficients
+    held at 0, so every face is solved for every athlete at once and the best feasible one
+    is kept: an exact bounded least squares, not a clipped unconstrained solution.
+
+    Returns:
+    ndarray: The solutions, (athletes, coefficients).
+    """
+    size = gram.shape[-1]
+    bounded = np.flatnonzero(lower_bounded)
+    held = np.zeros((2 ** len(bounded), size), dtype=bool)
+    held[:, bounded] = list(itertools.product([False, True], repeat=len(bounded)))
+    free = ~held
+
+    # Held coefficients get an identity row and a zero right-hand side, so they solve to 0
+    systems = np.where(free[:, :, None] & free[:, None, :], gram[:, None], 0) + np.eye(size) * held[:, :, None]
+    solutions = np.linalg.solve(systems, np.where(free, moment[:, None], 0)[..., None])[..., 0]
+
+    objective = (0.5 * np.einsum('afi,aij,afj->af', solutions, gram, solutions) -
+                 np.einsum('afi,ai->af', solutions, moment))
+    feasible = (solutions[..., bounded] >= 0).all(axis=-1)
+    best = np.where(feasible, objective, np.inf).argmin(axis=1)
+    return solutions[np.arange(len(gram)), best]
+
+
+def calibrate_pace_coefficients(histories, physiology=DEFAULT_PHYSIOLOGY, ridge=CALIBRATION_RIDGE):
+    """
+    Fit the estimate_pace_trimp coefficients of many athletes in one batch: ridge least squares
+    towards the defaults, solved for all athletes at once from their stacked normal equations
+    with the sensitivities bounded at 0 (see bounded_ridge_solve).
+
+    Args:
+    histories (list): One history (RunTable or list of run dicts) per athlete.
+
+    Returns:
+    list: (PaceCoefficients, number of runs used) per athlete, the defaults for athletes
+    with fewer than MIN_CALIBRATION_RUNS usable runs.
+    """
+    rows = [calibration_rows(history, physiology) for history in histories]
+    counts = np.array([len(targets) for _, targets in rows])
+    fitted = counts >= MIN_CALIBRATION_RUNS
+    defaults = np.array([getattr(DEFAULT_PACE_COEFFICIENTS, name) for name in COEFFICIENT_NAMES])
+    coefficients = np.tile(defaults, (len(histories), 1))
+
+    if fitted.any():
+        features = np.concatenate([rows[i][0] for i in np.flatnonzero(fitted)])
+        targets = np.concatenate([rows[i][1] for i in np.flatnonzero(fitted)])
+        starts = np.concatenate([[0], np.cumsum(counts[fitted])[:-1]])
+
+        # Per-athlete X'X and X'y as segment sums over the stacked rows
+        gram = np.add.reduceat(features[:, :, None] * features[:, None, :], starts, axis=0)
+        moment = np.add.reduceat(features * targets[:, None], starts, axis=0)
+        identity = np.eye(len(COEFFICIENT_NAMES))
+        coefficients[fitted] = bounded_ridge_solve(gram + ridge * identity, moment + ridge * defaults)
+
+    return [(PaceCoefficients(*map(float, values)), int(count)) for values, count in zip(coefficients, counts)]
+
+
+class CalibrationStore:
+    """
+    Per-athlete fitted PaceCoefficients saved as JSON files and kept in memory once read,
+    so plans of a calibrated athlete do not refit or reread them.
+    """
+
+    def __init__(self, folder=CALIBRATION_FOLDER):
+        self.folder = folder
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _path(self, athlete_id):
+        if not ATHLETE_ID_PATTERN.match(athlete_id):
+            raise ValueError(f"Invalid athlete id: {athlete_id}")
+        return os.path.join(self.folder, f"{athlete_id}.json")
+
+    def get(self, athlete_id):
+        """
+        Returns:
+        PaceCoefficients: The athlete's fitted coefficients, or None if never calibrated.
+        """
+        with self._lock:
+            if athlete_id in self._cache:
+                return self._cache[athlete_id]
+        try:
+            with open(self._path(athlete_id), 'r') as f:
+                coefficients = PaceCoefficients(**json.load(f)['coefficients'])
+        except FileNotFoundError:
+            coefficients = None
+        with self._lock:
+            self._cache[athlete_id] = coefficients
+        return coefficients
+
+    def put(self, athlete_id, coefficients, runs):
+        path = self._path(athlete_id)
+        with self._lock:
+            os.makedirs(self.folder, exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'coefficients': asdict(coefficients), 'runs': runs}, f)
+            os.replace(temp_path, path)
+            self._cache[athlete_id] = coefficients
+
+    def calibrate(self, histories, physiology=DEFAULT_PHYSIOLOGY):
+        """
+        Fit and store the coefficients of a roster.
+
+        Args:
+        histories (dict): athlete_id -> history.
+
+        Returns:
+        dict: athlete_id -> (PaceCoefficients, number of runs used).
+        """
+        for athlete_id in histories:
+            self._path(athlete_id)  # Validate every id before fitting
+        results = dict(zip(histories, calibrate_pace_coefficients(list(histories.values()), physiology)))
+        for athlete_id, (coefficients, runs) in results.items():
+            self.put(athlete_id, coefficients, runs)
+        return results
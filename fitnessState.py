@@ -0,0 +1,103 @@
+import json
+import os
+import re
+import threading
+from dataclasses import asdict
+from datetime import datetime
+
+from simulateRunPlan import (FitnessCheckpoint, RunTable, advance_fitness, before_current_week,
+                             load_run_table_sidecar, run_table_sidecar_paths, save_run_table_sidecar)
+
+CHECKPOINT_FOLDER = 'checkpoints'  # Folder where the per-athlete fitness checkpoints are stored
+
+ATHLETE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,128}$')
+
+
+class FitnessStateStore:
+    """
+    Per-athlete fitness checkpoints saved as JSON files, so a request carrying only new
+    runs advances the stored ATL/CTL instead of replaying the whole history.
+    Runs from the current week are kept as pending until their week is over; the folded runs
+    are kept as the athlete's history (a run table sidecar), for the past weeks of the plan.
+    """
+
+    def __init__(self, folder=CHECKPOINT_FOLDER):
+        self.folder = folder
+        self._lock = threading.RLock()
+
+    def _path(self, athlete_id):
+        if not ATHLETE_ID_PATTERN.match(athlete_id):
+            raise ValueError(f"Invalid athlete id: {athlete_id}")
+        return os.path.join(self.folder, f"{athlete_id}.json")
+
+    def _history_path(self, athlete_id):
+        # Base name of the history's sidecar files, see save_run_table_sidecar
+        return os.path.splitext(self._path(athlete_id))[0]
+
+    def get(self, athlete_id):
+        """
+        Returns:
+        tuple: The athlete's FitnessCheckpoint and RunTable of pending runs (empty for a new athlete).
+        """
+        try:
+            with open(self._path(athlete_id), 'r') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return FitnessCheckpoint(), RunTable.empty()
+        return FitnessCheckpoint.from_dict(saved['checkpoint']), RunTable.from_records(saved['pending'])
+
+    def history(self, athlete_id):
+        """
+        Returns:
+        RunTable: The runs folded into the athlete's checkpoint (empty for a new athlete).
+        """
+        return load_run_table_sidecar(self._history_path(athlete_id)) or RunTable.empty()
+
+    def put(self, athlete_id, checkpoint, pending, history=None):
+        records = [dict(run, date=run['date'].strftime('%Y-%m-%d')) for run in pending.records()]
+        path = self._path(athlete_id)
+        with self._lock:
+            os.makedirs(self.folder, exist_ok=True)
+            if history is not None:
+                save_run_table_sidecar(history, self._history_path(athlete_id))
+            # Write next to the checkpoint and swap, so readers never see a partial file
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'checkpoint': asdict(checkpoint), 'pending': records}, f)
+            os.replace(temp_path, path)
+
+    def reset(self, athlete_id):
+        # Drop the athlete's checkpoint, pending runs and history, the next advance replays from zero
+        with self._lock:
+            for path in (self._path(athlete_id),) + run_table_sidecar_paths(self._history_path(athlete_id)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def advance(self, athlete_id, new_runs, append=True):
+        """
+        Advance the athlete's checkpoint by new_runs and save it.
+        With append=False, new_runs is the full history and the state is replayed from zero.
+        Runs sent again (already pending or in the history) are not counted twice.
+
+        Returns:
+        tuple: The new FitnessCheckpoint and a RunTable of the athlete's history and pending runs.
+        """
+        today = datetime.now()
+        with self._lock:
+            if append:
+                checkpoint, pending = self.get(athlete_id)
+                history = self.history(athlete_id)
+                if len(new_runs):
+                    known = RunTable.concat([history.take(history.date >= new_runs.date.min()), pending])
+                    new_runs = new_runs.without(known.keys())
+                runs = RunTable.concat([pending, new_runs])
+            else:
+                checkpoint, history, runs = FitnessCheckpoint(), RunTable.empty(), new_runs
+            checkpoint, pending = advance_fitness(checkpoint, runs, today)
+            folded = runs.take(before_current_week(runs, today))
+            history = RunTable.concat([history, folded])
+            # The history is only rewritten when runs were folded into it
+            self.put(athlete_id, checkpoint, pending, history if len(folded) or not append else None)
+        return checkpoint, RunTable.concat([history, pending])
@@ -0,0 +1,112 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueueFull(Exception):
+    """
+    Raised by JobQueue.submit when max_pending jobs are already queued or running.
+    """
+
+
+class Job:
+    """
+    One submitted computation: its status ('queued', 'running', 'done' or 'failed'),
+    progress between 0 and 1, and its result or error message once finished.
+    """
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'queued'
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    def set_progress(self, done, total):
+        if total:
+            self.progress = min(done / total, 1.0)
+
+    def to_dict(self):
+        job = {'id': self.id, 'kind': self.kind, 'status': self.status, 'progress': round(self.progress, 4),
+               'submitted_at': self.submitted_at, 'finished_at': self.finished_at}
+        if self.status == 'done':
+            job['result'] = self.result
+        elif self.status == 'failed':
+            job['error'] = self.error
+        return job
+
+
+class JobQueue:
+    """
+    Background executor for long simulations with a bounded number of pending jobs,
+    so a burst of large requests is refused with backpressure instead of tying up
+    every server thread. Finished jobs are kept for result_ttl seconds, and at most
+    max_finished of them (the oldest are dropped first), so results cannot pile up.
+    """
+
+    def __init__(self, max_workers=2, max_pending=32, result_ttl=600, max_finished=128):
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='plan-job')
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func, *args):
+        """
+        Queue func(*args, progress=job.set_progress).
+
+        Returns:
+        Job: The queued job.
+        """
+        job = Job(kind)
+        with self._lock:
+            self._expire()
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"{self._pending} jobs are pending, try again later.")
+            self._pending += 1
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def _run(self, job, func, args):
+        job.status = 'running'
+        try:
+            job.result = func(*args, progress=job.set_progress)
+            job.progress = 1.0
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+                self._expire()
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def _expire(self):
+        # Called with the lock held
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+        finished = sorted((job for job in self._jobs.values() if job.finished_at is not None),
+                          key=lambda job: job.finished_at)
+        for job in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[job.id]
+
+    def stats(self):
+        with self._lock:
+            return {'pending': self._pending, 'max_pending': self.max_pending, 'stored': len(self._jobs),
+                    'max_finished': self.max_finished}
@@ -0,0 +1,319 @@
+"""
+Load harness for the planner server: starts server.py under waitress in a subprocess, drives
+its routes with concurrent clients and reports throughput and p50/p95/p99 latency.
+
+The server is restarted for every waitress thread count of the sweep, so the tables show
+where adding threads stops adding throughput, i.e. where simulation CPU time saturates the
+pool. Payloads change from request to request so the plan cache is not what is measured
+(--cached sends identical payloads instead).
+
+    python loadTest.py                                  # every scenario, threads 1 2 4 8
+    python loadTest.py --scenarios historical --runs 10000 --weeks 200
+    python loadTest.py --threads 4 --concurrency 1 8 32 --requests 500
+    python loadTest.py --json load_results.json         # also save the results
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from benchmark import generate_history_csv, generate_plan_dates
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = ('index', 'config', 'historical', 'batch')
+
+DEFAULT_THREADS = (1, 2, 4, 8)
+DEFAULT_CONCURRENCY = (1, 4, 16)
+
+SATURATION_SHARE = 0.9  # A sweep saturates at the first thread count with this share of the best throughput
+
+# Logged by waitress when requests wait for a free thread
+QUEUE_WARNING = 'Task queue depth is'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ServerProcess:
+    """
+    server:app under waitress with a given number of threads, in a subprocess on a free local port.
+    The waitress log goes to a temporary file, read back for its queue depth warnings.
+    """
+
+    def __init__(self, threads, startup_timeout=30):
+        self.threads = threads
+        self.startup_timeout = startup_timeout
+        self.port = free_port()
+        self.process = None
+        self.log = None
+
+    def __enter__(self):
+        self.log = tempfile.TemporaryFile(mode='w+')
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'waitress', f'--threads={self.threads}', '--host=127.0.0.1',
+             f'--port={self.port}', 'server:app'],
+            cwd=SERVER_DIR, stdout=self.log, stderr=subprocess.STDOUT)
+        try:
+            self._wait_ready()
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"The server exited with status {self.process.returncode}:\n{self.read_log()}")
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=1)
+                connection.request('GET', '/metrics')
+                if connection.getresponse().status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError(f"The server did not answer within {self.startup_timeout} s:\n{self.read_log()}")
+
+    def read_log(self):
+        self.log.flush()
+        self.log.seek(0)
+        return self.log.read()
+
+    def queue_warnings(self):
+        return self.read_log().count(QUEUE_WARNING)
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+
+def scenario_requests(num_runs, num_weeks, batch_size, cached=False):
+    """
+    Request builders of the scenarios: scenario -> function(n) returning the method, path,
+    body and headers of the n-th request. Unless cached, payloads vary with n so no plan is
+    served from the plan cache: a config's starting ATL, or the TRIMP of the latest run of a
+    history before this week. Either changes the starting fitness, so the simulated weeks are
+    not resumed from week_checkpoints either and every request simulates its whole plan.
+
+    Returns:
+    dict: The builders, keyed by the names in SCENARIOS.
+    """
+    start_date, end_date = generate_plan_dates(num_weeks)
+    csv_data = generate_history_csv(num_runs)
+    header, *runs = csv_data.split('\n')
+    columns = header.split(',')
+    date_column, trimp_column = columns.index('date'), columns.index('trimp')
+    # Older runs have decayed out of ATL and CTL, the latest run folded into them has not
+    today = datetime.now()
+    week_start = f"{today - timedelta(days=today.weekday()):%Y-%m-%d}"
+    varied = max((i for i, run in enumerate(runs) if run and run.split(',')[date_column] < week_start),
+                 default=0)
+    varied_fields = runs[varied].split(',')
+    json_headers = {'Content-Type': 'application/json'}
+
+    def config_payload(n):
+        return {'type': 'config', 'format': 'json', 'config': {
+            'initial_atl': 60.0 if cached else 60.0 + n / 10000, 'initial_ctl': 39.0,
+            'long_run_duration': 60, 'tempo_run_duration': 45, 'long_run_pace': 7.5, 'tempo_run_pace': 6.3,
+            'start_date': f"{start_date:%Y-%m-%d}", 'end_date': f"{end_date:%Y-%m-%d}"}}
+
+    def history_csv(n):
+        if cached:
+            return csv_data
+        fields = list(varied_fields)
+        fields[trimp_column] = f"{float(varied_fields[trimp_column]) + n / 10000:.4f}"
+        return '\n'.join([header, *runs[:varied], ','.join(fields), *runs[varied + 1:]])
+
+    def historical_payload(n):
+        return {'type': 'historical', 'format': 'json', 'csv': history_csv(n),
+                'start_date': f"{start_date:%Y-%m-%d}", 'end_date': f"{end_date:%Y-%m-%d}"}
+
+    def post(path, payload):
+        return 'POST', path, json.dumps(payload).encode('utf-8'), json_headers
+
+    return {
+        'index': lambda n: ('GET', '/', None, {}),
+        'config': lambda n: post('/generate_plan', config_payload(n)),
+        'historical': lambda n: post('/generate_plan', historical_payload(n)),
+        'batch': lambda n: post('/generate_plan/batch', {'athletes': [
+            dict(historical_payload(n * batch_size + i), id=i) for i in range(batch_size)]}),
+    }
+
+
+def run_load(port, make_request, concurrency, num_requests, first=0, timeout=120):
+    """
+    Send num_requests requests (numbered from first, see scenario_requests) from concurrency
+    client threads, each on its own keep-alive connection, as fast as the server answers them.
+
+    Returns:
+    dict: Requests, errors, wall time, throughput (requests per second) and latency percentiles in ms.
+    """
+    counter = itertools.count(first)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def client():
+        nonlocal errors
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+        while True:
+            n = next(counter)
+            if n >= first + num_requests:
+                break
+            method, path, body, headers = make_request(n)
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors += not ok
+        connection.close()
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000 if latencies else (np.nan,) * 3
+    return {'requests': len(latencies), 'errors': errors, 'seconds': round(seconds, 3),
+            'throughput': round(len(latencies) / seconds, 2), 'p50_ms': round(float(p50), 2),
+            'p95_ms': round(float(p95), 2), 'p99_ms': round(float(p99), 2)}
+
+
+def run_sweep(scenarios, thread_counts, concurrencies, num_requests, builders, warmup=5, report=print):
+    """
+    Start the server once per thread count and load every scenario at every concurrency.
+    report is called with each result row as it is measured.
+
+    Returns:
+    list: Result rows (dicts with threads, scenario, concurrency, run_load's values and the
+    number of waitress queue warnings logged during the run).
+    """
+    rows = []
+    for threads in thread_counts:
+        with ServerProcess(threads) as server:
+            for scenario in scenarios:
+                # Warm up templates, caches of parsed configs and the batch process pool
+                run_load(server.port, builders[scenario], 1, warmup)
+                sent = warmup  # Request numbers go on across runs, so no payload is sent twice
+                for concurrency in concurrencies:
+                    warnings_before = server.queue_warnings()
+                    result = run_load(server.port, builders[scenario], concurrency, num_requests, sent)
+                    sent += num_requests
+                    row = {'threads': threads, 'scenario': scenario, 'concurrency': concurrency, **result,
+                           'queue_warnings': server.queue_warnings() - warnings_before}
+                    rows.append(row)
+                    report(row)
+    return rows
+
+
+def saturation(rows, share=SATURATION_SHARE):
+    """
+    For every scenario and concurrency swept over more than one thread count: the best
+    throughput, its thread count, and the fewest threads reaching share of it.
+
+    Returns:
+    list: (scenario, concurrency, best throughput, best threads, saturating threads) tuples.
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault((row['scenario'], row['concurrency']), []).append(row)
+    summary = []
+    for (scenario, concurrency), group in groups.items():
+        if len(group) < 2:
+            continue
+        group.sort(key=lambda row: row['threads'])
+        best = max(group, key=lambda row: row['throughput'])
+        saturating = next(row for row in group if row['throughput'] >= share * best['throughput'])
+        summary.append((scenario, concurrency, best['throughput'], best['threads'], saturating['threads']))
+    return summary
+
+
+def print_header():
+    print(f"{'threads':>7} {'scenario':<11} {'conc':>5} {'requests':>8} {'errors':>6} {'req/s':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queued':>6}")
+
+
+def print_row(row):
+    print(f"{row['threads']:>7} {row['scenario']:<11} {row['concurrency']:>5} {row['requests']:>8} "
+          f"{row['errors']:>6} {row['throughput']:>9.2f} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} "
+          f"{row['p99_ms']:>9.2f} {row['queue_warnings']:>6}", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the planner server under waitress.")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS),
+                        help="Routes to drive.")
+    parser.add_argument('--threads', type=int, nargs='+', default=list(DEFAULT_THREADS),
+                        help="Waitress thread counts to sweep.")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=list(DEFAULT_CONCURRENCY),
+                        help="Concurrent clients per run.")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per run.")
+    parser.add_argument('--runs', type=int, default=1000, help="Runs in the history of historical plans.")
+    parser.add_argument('--weeks', type=int, default=20, help="Weeks per plan.")
+    parser.add_argument('--batch-size', type=int, default=8, help="Athletes per batch request.")
+    parser.add_argument('--cached', action='store_true',
+                        help="Send identical payloads, so plans are served from the plan cache.")
+    parser.add_argument('--json', help="Save the result rows to this file.")
+    args = parser.parse_args(argv)
+
+    builders = scenario_requests(args.runs, args.weeks, args.batch_size, args.cached)
+    print(f"{os.cpu_count()} CPUs, {args.requests} requests per run, {args.runs} runs, {args.weeks} weeks, "
+          f"batches of {args.batch_size}")
+    print_header()
+    try:
+        rows = run_sweep(args.scenarios, args.threads, args.concurrency, args.requests, builders,
+                         report=print_row)
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    summary = saturation(rows)
+    if summary:
+        print()
+        print(f"Saturation (first thread count with {SATURATION_SHARE:.0%} of the best throughput):")
+        for scenario, concurrency, throughput, best_threads, saturating_threads in summary:
+            print(f"  {scenario:<11} concurrency {concurrency:>3}: {throughput:.2f} req/s best with "
+                  f"{best_threads} threads, saturated from {saturating_threads}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'cpus': os.cpu_count(), 'arguments': vars(args), 'results': rows}, f, indent=2)
+        print(f"Results saved to {args.json}.")
+
+    return 1 if any(row['errors'] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
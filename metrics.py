@@ -0,0 +1,138 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Latency histogram bucket bounds in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Prometheus-style histogram: observation counts per bucket upper bound plus their sum.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{format_labels(labels, le=bound)} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {self.sum}')
+        lines.append(f'{name}_count{format_labels(labels)} {self.count}')
+        return lines
+
+
+def format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + '}'
+
+
+class MetricsRegistry:
+    """
+    Timers for the planner stages and the server routes, rendered in the Prometheus text format.
+    Safe to share between waitress threads; each process has its own counts.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._stages = {}
+        self._requests = {}
+        self._request_counts = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time_stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start)
+
+    def observe_request(self, route, method, status, seconds):
+        with self._lock:
+            histogram = self._requests.get((route, method))
+            if histogram is None:
+                histogram = self._requests[(route, method)] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            key = (route, method, str(status))
+            self._request_counts[key] = self._request_counts.get(key, 0) + 1
+            if status >= 400:
+                self._errors[(route, method)] = self._errors.get((route, method), 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+            self._requests.clear()
+            self._request_counts.clear()
+            self._errors.clear()
+
+    def render(self, gauges=None):
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Args:
+        gauges (dict): Extra values to expose as {name: (help text, value)}.
+
+        Returns:
+        str: The exposition text.
+        """
+        lines = []
+        with self._lock:
+            lines += ['# HELP plan_stage_duration_seconds Time spent in each planner stage.',
+                      '# TYPE plan_stage_duration_seconds histogram']
+            for stage, histogram in sorted(self._stages.items()):
+                lines += histogram.render('plan_stage_duration_seconds', [('stage', stage)])
+
+            lines += ['# HELP http_request_duration_seconds Request latency per route.',
+                      '# TYPE http_request_duration_seconds histogram']
+            for (route, method), histogram in sorted(self._requests.items()):
+                lines += histogram.render('http_request_duration_seconds', [('route', route), ('method', method)])
+
+            lines += ['# HELP http_requests_total Requests per route and status code.',
+                      '# TYPE http_requests_total counter']
+            for (route, method, status), count in sorted(self._request_counts.items()):
+                labels = format_labels([('route', route), ('method', method), ('status', status)])
+                lines.append(f'http_requests_total{labels} {count}')
+
+            lines += ['# HELP http_request_errors_total Requests per route answered with a 4xx or 5xx status.',
+                      '# TYPE http_request_errors_total counter']
+            for (route, method), count in sorted(self._errors.items()):
+                lines.append(f'http_request_errors_total{format_labels([("route", route), ("method", method)])} {count}')
+
+        for name, (help_text, value) in (gauges or {}).items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+# Registry shared by the planner and the server
+registry = MetricsRegistry()
+
+
+def stage_timer(stage):
+    """
+    Time a planner stage into the shared registry, as a context manager or a decorator.
+    """
+    return registry.time_stage(stage)
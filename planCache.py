@@ -0,0 +1,82 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache with a time-to-live, safe to share between waitress threads.
+    Keeps hit, miss and eviction counters for monitoring.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=900):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._entries), 'max_entries': self.max_entries}
+
+
+def plan_cache_key(user_params, csv_data, general_config, current_week, variant=None):
+    """
+    Hash everything a generated plan depends on into a cache key.
+
+    Args:
+    user_params (dict): The normalized plan parameters (dates may be datetime objects).
+    csv_data (str): The historical runs CSV, or None for config plans.
+    general_config (dict): The general config values the plan was simulated with.
+    current_week: The current week of the plan, plus anything else tied to today's date.
+    variant (str): What is cached for these inputs, e.g. the output format.
+
+    Returns:
+    str: A hex SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(user_params, sort_keys=True, default=str).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update((csv_data or '').encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(json.dumps(general_config, sort_keys=True).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(json.dumps(current_week, default=str).encode('utf-8'))
+    if variant is not None:
+        digest.update(b'\0')
+        digest.update(variant.encode('utf-8'))
+    return digest.hexdigest()
@@ -0,0 +1,138 @@
+import csv
+import json
+from io import StringIO
+
+from simulateRunPlan import calculate_sunday_date
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+EXPORT_COLUMNS = ['athlete_id', 'week', 'week_sunday', 'type', 'duration', 'avg_hr', 'avg_power', 'trimp', 'pace',
+                  'distance']
+
+EXPORT_CHUNK_ROWS = 1000  # Rows buffered per yielded chunk (per row group for Parquet)
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def iter_plan_rows(training_plan, start_date=None, athlete_id=None):
+    """
+    Yield one tuple per session of a simulate_training_plan result, in EXPORT_COLUMNS order.
+    Durations are in minutes, paces in min/km and distances in km. week_sunday is computed
+    from start_date as format_week does, so exports give the dates of the JSON and HTML views;
+    the week entry's own date is only used without a start_date.
+    """
+    for week_data in training_plan:
+        if start_date is not None:
+            week_sunday = calculate_sunday_date(start_date, week_data['week']).strftime('%Y-%m-%d')
+        else:
+            week_sunday = week_data.get('week_sunday')
+        for session in week_data['plan']:
+            yield (athlete_id, week_data['week'], week_sunday, session.type, float(session.duration),
+                   float(session.avg_hr), float(session.avg_power), float(session.trimp), float(session.pace),
+                   float(session.distance))
+
+
+def _chunks(rows, size=EXPORT_CHUNK_ROWS):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_csv(rows):
+    """
+    Stream rows as CSV text, header first, one chunk per EXPORT_CHUNK_ROWS rows.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in _chunks(rows):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_ndjson(rows):
+    """
+    Stream rows as newline-delimited JSON objects.
+    """
+    for chunk in _chunks(rows):
+        yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n' for row in chunk)
+
+
+class _ChunkSink:
+    # Write-only file object that hands what was written so far back to the generator
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def export_parquet(rows):
+    """
+    Stream rows as a Parquet file, one row group per EXPORT_CHUNK_ROWS rows.
+    Requires pyarrow.
+    """
+    if pq is None:
+        raise ValueError("Parquet export requires pyarrow (pip install pyarrow).")
+
+    schema = pa.schema([('athlete_id', pa.string()), ('week', pa.int32()), ('week_sunday', pa.string()),
+                        ('type', pa.string())] +
+                       [(name, pa.float64()) for name in EXPORT_COLUMNS[4:]])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for chunk in _chunks(rows):
+            columns = list(zip(*chunk))
+            writer.write_batch(pa.record_batch([pa.array(values, type=field.type)
+                                                for values, field in zip(columns, schema)], schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+EXPORTERS = {'csv': export_csv, 'ndjson': export_ndjson, 'parquet': export_parquet}
+
+
+def export_rows(rows, export_format):
+    """
+    Returns:
+    generator: The chunks (str, or bytes for Parquet) of rows exported in export_format.
+    """
+    if export_format not in EXPORTERS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    if export_format == 'parquet' and pq is None:
+        raise ValueError("Parquet export requires pyarrow (pip install pyarrow).")
+    return EXPORTERS[export_format](rows)
@@ -0,0 +1,271 @@
+from dataclasses import replace
+from typing import NamedTuple
+
+import numpy as np
+
+from simulateRunPlan import (DEFAULT_PACE_COEFFICIENTS, HALF_MARATHON_VOLUME, SHORT_RACE_DISTANCE, adjust_duration,
+                             calculate_num_weeks, generate_weekly_plan, get_current_week, load_historic_runs,
+                             load_physiology_config, predict_race, simulate_week)
+
+# Parameters a sweep can vary, the first three override the general config
+SWEEP_PARAMETERS = ['progressive_overload', 'max_long_run_duration', 'max_tempo_run_duration',
+                    'long_run_duration', 'tempo_run_duration']
+
+MAX_SWEEP_COMBINATIONS = 200000
+
+# Weekly duration multipliers the optimizer chooses from
+DURATION_MULTIPLIERS = (0.7, 0.8, 0.9, 1.0, 1.05, 1.1, 1.15, 1.2, 1.3)
+DEFAULT_TSB_FLOOR = -1.0  # In the model's TRIMP / 100 units
+OPTIMIZER_BEAM_WIDTH = 256
+# Less volume always predicts a faster pace in this model, so every optimized week keeps at least this
+# share of the default schedule's long and tempo run distance, and the last week still prepares the race
+MIN_VOLUME_SHARE = 0.85
+
+
+class WeekState(NamedTuple):
+    """
+    State carried from one simulated week to the next, one array element per simulated plan.
+    """
+    atl: np.ndarray
+    ctl: np.ndarray
+    tsb: np.ndarray
+    long_run_duration: np.ndarray
+    tempo_run_duration: np.ndarray
+    long_run_pace: np.ndarray
+    tempo_run_pace: np.ndarray
+
+    @classmethod
+    def from_config(cls, config, size, long_run_duration=None, tempo_run_duration=None):
+        def full(value):
+            return np.full(size, float(value))
+        atl, ctl = full(config['initial_atl']), full(config['initial_ctl'])
+        return cls(atl, ctl, ctl - atl,
+                   full(config['long_run_duration']) if long_run_duration is None else long_run_duration,
+                   full(config['tempo_run_duration']) if tempo_run_duration is None else tempo_run_duration,
+                   full(config['long_run_pace']), full(config['tempo_run_pace']))
+
+    def take(self, index):
+        return WeekState(*[values[index] for values in self])
+
+
+def simulate_week_batch(week, state, physiology, duration_multiplier=None, coefficients=DEFAULT_PACE_COEFFICIENTS):
+    """
+    Batched simulation kernel: plan and simulate one week for every state at once.
+
+    Returns:
+    tuple: The WeekState after the week and its weekly plan (sessions holding arrays).
+    """
+    weekly_plan, long_run_duration, tempo_run_duration = generate_weekly_plan(
+        week, state.long_run_duration, state.tempo_run_duration, state.long_run_pace, state.tempo_run_pace,
+        state.atl, state.ctl, physiology, duration_multiplier, coefficients)
+    atl, ctl, tsb, _ = simulate_week(weekly_plan, state.atl, state.ctl)
+    return WeekState(atl, ctl, tsb, long_run_duration, tempo_run_duration,
+                     weekly_plan[0].pace, weekly_plan[1].pace), weekly_plan
+
+
+def plan_weeks(config):
+    num_weeks = calculate_num_weeks(config['start_date'], config['end_date'])
+    current_week = get_current_week(config['start_date'])
+    if current_week > num_weeks:
+        raise ValueError("The plan has no weeks left to simulate.")
+    return range(current_week, num_weeks + 1)
+
+
+def parameter_grid(grid):
+    """
+    Expand {parameter: [values]} into one flat array per parameter holding every combination.
+    """
+    unknown = set(grid) - set(SWEEP_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+
+    names = [name for name in SWEEP_PARAMETERS if name in grid]
+    axes = [np.atleast_1d(np.asarray(grid[name], dtype=np.float64)) for name in names]
+    size = int(np.prod([len(axis) for axis in axes])) if axes else 1
+    if size > MAX_SWEEP_COMBINATIONS:
+        raise ValueError(f"Sweep has {size} combinations, the limit is {MAX_SWEEP_COMBINATIONS}.")
+    if size == 0:
+        raise ValueError("Sweep has no combinations.")
+
+    mesh = np.meshgrid(*axes, indexing='ij')
+    return {name: values.ravel() for name, values in zip(names, mesh)}, size
+
+
+def sweep_training_plans(config, grid, historical_runs=None, physiology=None, progress=None):
+    """
+    Simulate every combination of the grid values at once. The weekly model functions
+    (generate_weekly_plan, adjust_duration, estimate_pace_trimp, simulate_week) run on arrays
+    holding one value per combination, so the cost is one plan's worth of NumPy calls.
+
+    Args:
+    config (dict): Plan parameters as for simulate_training_plan.
+    grid (dict): Values to try for some of SWEEP_PARAMETERS; the others come from config.
+    historical_runs: Optional history to start from instead of the config values.
+    progress: Optional callback, called as progress(weeks done, weeks to simulate).
+
+    Returns:
+    dict: One array per column: the swept parameters, final ATL/CTL/TSB and the predicted race.
+    """
+    if historical_runs is not None:
+        config, historical_runs = load_historic_runs(config, historical_runs)
+    if physiology is None:
+        physiology = load_physiology_config()
+
+    values, size = parameter_grid(grid)
+
+    def column(name, default):
+        return values[name] if name in values else np.full(size, float(default))
+
+    physiology = replace(
+        physiology,
+        progressive_overload=column('progressive_overload', physiology.progressive_overload),
+        max_long_run_duration=column('max_long_run_duration', physiology.max_long_run_duration),
+        max_tempo_run_duration=column('max_tempo_run_duration', physiology.max_tempo_run_duration))
+
+    state = WeekState.from_config(config, size, column('long_run_duration', config['long_run_duration']),
+                                  column('tempo_run_duration', config['tempo_run_duration']))
+    weeks = plan_weeks(config)
+    for done, week in enumerate(weeks, start=1):
+        state, weekly_plan = simulate_week_batch(week, state, physiology)
+        if progress is not None:
+            progress(done, len(weeks))
+
+    long_race_distance, tempo_race_distance, long_race_time, tempo_race_time = predict_race(weekly_plan)
+
+    summary = dict(values)
+    summary.update({
+        'final_atl': state.atl,
+        'final_ctl': state.ctl,
+        'final_tsb': state.tsb,
+        'race_distance': long_race_distance + tempo_race_distance,
+        'race_time': long_race_time + tempo_race_time,
+    })
+    return summary
+
+
+def default_multipliers(weeks, physiology):
+    # The 3-up/1-down cycle of adjust_duration expressed as multipliers
+    return [float(adjust_duration(week, 1.0, physiology)) for week in weeks]
+
+
+def race_volume(weekly_plan):
+    # Long run plus tempo run distance of a week, the volume predict_race picks the race distance from
+    for session in weekly_plan:
+        if session.type == 'long_run':
+            long_run_distance = session.distance
+        elif session.type == 'tempo_run_1':
+            tempo_run_distance = session.distance
+    return long_run_distance + tempo_run_distance
+
+
+def volume_floors(default_volumes, race_distance, share=MIN_VOLUME_SHARE):
+    """
+    Weekly race_volume an optimized schedule has to keep: share of the default schedule's,
+    and in the last week enough for predict_race to still pick race_distance.
+    """
+    floors = share * np.asarray(default_volumes, dtype=np.float64)
+    if race_distance > SHORT_RACE_DISTANCE:
+        floors[-1] = max(floors[-1], np.nextafter(HALF_MARATHON_VOLUME, np.inf))
+    return floors
+
+
+def race_time_over(weekly_plan, race_distance):
+    # Race time as in predict_race, for a fixed race distance
+    for session in weekly_plan:
+        if session.type == 'long_run':
+            long_run_pace = session.pace
+        elif session.type == 'tempo_run_1':
+            tempo_run_pace = session.pace
+    return race_distance * 2 / 3 * long_run_pace + race_distance * 1 / 3 * tempo_run_pace
+
+
+def evaluate_multipliers(config, physiology, schedule, tsb_floor=DEFAULT_TSB_FLOOR, race_distance=None,
+                         coefficients=DEFAULT_PACE_COEFFICIENTS):
+    """
+    Simulate one duration schedule. The race time is over race_distance when given,
+    otherwise over the distance predict_race picks from the last week. 'volumes' holds
+    every week's race_volume.
+    """
+    state = WeekState.from_config(config, 1)
+    feasible = True
+    volumes = []
+    for week, multiplier in zip(plan_weeks(config), schedule):
+        state, weekly_plan = simulate_week_batch(week, state, physiology, multiplier, coefficients)
+        feasible = feasible and bool(state.tsb[0] >= tsb_floor)
+        volumes.append(float(race_volume(weekly_plan)[0]))
+    if race_distance is None:
+        long_race_distance, tempo_race_distance, _, _ = predict_race(weekly_plan)
+        race_distance = float((long_race_distance + tempo_race_distance)[0])
+    return {'multipliers': list(schedule), 'race_time': float(race_time_over(weekly_plan, race_distance)[0]),
+            'race_distance': race_distance, 'feasible': feasible, 'volumes': volumes}
+
+
+def optimize_duration_multipliers(config, physiology, tsb_floor=DEFAULT_TSB_FLOOR,
+                                  multipliers=DURATION_MULTIPLIERS, beam_width=OPTIMIZER_BEAM_WIDTH,
+                                  coefficients=DEFAULT_PACE_COEFFICIENTS):
+    """
+    Search per-week duration multipliers that minimize the predicted race time, keeping TSB
+    above tsb_floor after every week. Durations stay capped at the configured maxima by
+    generate_weekly_plan. The race distance is the one the default 3-up/1-down schedule
+    prepares for, so schedules are compared over the same race, and every week keeps the
+    volume of volume_floors so the schedule still prepares for it.
+
+    Beam search: every week the kept states are expanded with every multiplier in one batched
+    kernel call. States that are equal after rounding are memoized into one, and the
+    beam_width states with the best race time so far are kept, those short of the volume
+    floors last. The default schedule is returned if nothing better is found.
+
+    Returns:
+    dict: 'multipliers' (one per simulated week), 'race_time' in minutes, 'race_distance' in km
+    and 'feasible' (False when no schedule keeps TSB above the floor and the volume every week).
+    """
+    weeks = plan_weeks(config)
+    choices = np.asarray(multipliers, dtype=np.float64)
+    default = evaluate_multipliers(config, physiology, default_multipliers(weeks, physiology), tsb_floor,
+                                   coefficients=coefficients)
+    race_distance = default['race_distance']
+    floors = volume_floors(default['volumes'], race_distance)
+
+    state = WeekState.from_config(config, 1)
+    feasible = np.ones(1, dtype=bool)
+    shortfall = np.zeros(1)  # km below the volume floors so far
+    history = []  # per week: (parent index, multiplier) of every kept state
+    for floor, week in zip(floors, weeks):
+        parents = np.repeat(np.arange(len(state.atl)), len(choices))
+        chosen = np.tile(choices, len(state.atl))
+        candidates, weekly_plan = simulate_week_batch(week, state.take(parents), physiology, chosen, coefficients)
+        race_time = race_time_over(weekly_plan, race_distance)
+        candidate_shortfall = shortfall[parents] + np.maximum(floor - race_volume(weekly_plan), 0)
+
+        # States keeping the volume floors first, then feasible ones, then by race time;
+        # infeasible ones by how far TSB is below the floor
+        candidate_feasible = feasible[parents] & (candidates.tsb >= tsb_floor)
+        order = np.lexsort((race_time, -np.minimum(candidates.tsb - tsb_floor, 0), ~candidate_feasible,
+                            candidate_shortfall))
+
+        # Memoize states that are equal after rounding, keeping the best ranked one
+        keys = np.round(np.column_stack([candidates.atl, candidates.ctl, candidates.long_run_duration,
+                                         candidates.tempo_run_duration, candidates.long_run_pace,
+                                         candidates.tempo_run_pace])[order], 6)
+        _, first = np.unique(keys, axis=0, return_index=True)
+        kept = order[np.sort(first)[:beam_width]]
+
+        history.append((parents[kept], chosen[kept]))
+        state = candidates.take(kept)
+        feasible = candidate_feasible[kept]
+        shortfall = candidate_shortfall[kept]
+        best_race_time = race_time[kept]
+
+    # Walk back from the best final state
+    index = 0
+    schedule = []
+    for parents, chosen in reversed(history):
+        schedule.append(float(chosen[index]))
+        index = parents[index]
+    schedule.reverse()
+    best = {'multipliers': schedule, 'race_time': float(best_race_time[0]), 'race_distance': race_distance,
+            'feasible': bool(feasible[0] and shortfall[0] == 0)}
+
+    if (default['feasible'], -default['race_time']) > (best['feasible'], -best['race_time']):
+        return default
+    return best
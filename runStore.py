@@ -0,0 +1,199 @@
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from fitnessState import ATHLETE_ID_PATTERN, CHECKPOINT_FOLDER, FitnessStateStore
+from metrics import stage_timer
+from simulateRunPlan import RunTable, advance_fitness, as_run_table, parse_run_table
+
+RUN_STORE_FILENAME = 'runs.db'  # SQLite database of the stored runs
+
+# Fitness checkpoints of the stored athletes, apart from those of athletes sending their runs
+RUN_STORE_CHECKPOINT_FOLDER = os.path.join(CHECKPOINT_FOLDER, 'run_store')
+
+RUN_COLUMNS = ['date', 'duration', 'pace', 'vo2max', 'avg_power', 'avg_hr', 'distance', 'trimp', 'run_type']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    athlete_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    run_type TEXT NOT NULL,
+    duration REAL, pace REAL, vo2max REAL, avg_power REAL, avg_hr REAL, distance REAL, trimp REAL
+);
+-- A run is stored once: (athlete_id, date, run_type) leads, so date ranges are index range scans
+CREATE UNIQUE INDEX IF NOT EXISTS runs_athlete_run ON runs (
+    athlete_id, date, run_type, duration, pace, vo2max, avg_power, avg_hr, distance, trimp
+);
+"""
+
+
+class UnknownAthlete(Exception):
+    """
+    Raised by RunStore.athlete_runs for an athlete without stored runs.
+    """
+
+
+def _day(value):
+    # 'YYYY-MM-DD' of a date, datetime (time of day dropped), datetime64 or ISO string
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.strptime(value[:10], '%Y-%m-%d')
+    return str(np.datetime64(value, 'D'))
+
+
+class AthleteRuns:
+    """
+    One athlete's runs in a RunStore, passed as historical_runs instead of a parsed CSV.
+    The simulation reads it window by window (see simulateRunPlan.history_window), so the
+    fitness replay and the plan's past weeks each query only the dates they use.
+    """
+
+    def __init__(self, store, athlete_id):
+        self.store = store
+        self.athlete_id = athlete_id
+
+    def window(self, start=None, end=None):
+        return self.store.window(self.athlete_id, start, end)
+
+
+class RunStore:
+    """
+    SQLite store of every athlete's runs, indexed on (athlete_id, date, run_type), so plans
+    need only an athlete id and reading a date range is an index range scan.
+    Runs of an athlete are kept in date order, runs of the same day in insertion order; a run
+    sent again is stored once.
+    The athlete's fitness before the current week is checkpointed in a FitnessStateStore and
+    only the runs after the checkpoint are replayed; inserting an older run drops the checkpoint.
+    """
+
+    def __init__(self, filename=RUN_STORE_FILENAME, checkpoint_folder=RUN_STORE_CHECKPOINT_FOLDER):
+        self.filename = filename
+        self.checkpoints = FitnessStateStore(checkpoint_folder)
+        with closing(self._connect()) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')  # Readers do not wait for an import
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        # One connection per operation, so the store is safe to share between threads and processes
+        return sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+
+    @contextmanager
+    def _transaction(self):
+        with closing(self._connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    @staticmethod
+    def _check_id(athlete_id):
+        if not ATHLETE_ID_PATTERN.match(athlete_id or ''):
+            raise ValueError(f"Invalid athlete id: {athlete_id}")
+
+    def athlete_runs(self, athlete_id):
+        self._check_id(athlete_id)
+        if not self.has_runs(athlete_id):
+            raise UnknownAthlete(f"No runs stored for athlete {athlete_id}, import them with POST /runs/{athlete_id}.")
+        return AthleteRuns(self, athlete_id)
+
+    def insert(self, athlete_id, historical_runs, replace=False):
+        """
+        Bulk insert runs (RunTable or list of run dicts) of an athlete in one transaction.
+        Runs already stored are skipped. With replace=True they replace every stored run of the athlete.
+
+        Returns:
+        int: The number of runs inserted.
+        """
+        self._check_id(athlete_id)
+        runs = as_run_table(historical_runs)
+        dates = runs.date.astype('datetime64[D]').astype(str).tolist()
+        rows = zip([athlete_id] * len(runs), dates, runs.run_type.tolist(),
+                   *[getattr(runs, name).tolist() for name in RUN_COLUMNS[1:-1]])
+        with self._transaction() as connection:
+            if replace:
+                connection.execute('DELETE FROM runs WHERE athlete_id = ?', (athlete_id,))
+            changes = connection.total_changes
+            connection.executemany(
+                'INSERT OR IGNORE INTO runs (athlete_id, date, run_type, duration, pace, vo2max, avg_power, avg_hr, '
+                'distance, trimp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            inserted = connection.total_changes - changes
+            # Dropped inside the transaction, so fitness() cannot save a checkpoint missing these runs
+            last_date = self.checkpoints.get(athlete_id)[0].last_date
+            if replace or (inserted and last_date is not None and min(dates) < last_date):
+                # The checkpoint no longer holds every run up to its date
+                self.checkpoints.reset(athlete_id)
+        return inserted
+
+    def import_csv(self, athlete_id, csv_text, replace=False):
+        # Bulk insert from the historical runs CSV format
+        return self.insert(athlete_id, parse_run_table(csv_text), replace)
+
+    @stage_timer('run_store_query')
+    def window(self, athlete_id, start=None, end=None, connection=None):
+        """
+        Returns:
+        RunTable: The athlete's runs dated on or after start and before end (either may be None).
+        """
+        query = 'SELECT ' + ', '.join(RUN_COLUMNS) + ' FROM runs WHERE athlete_id = ?'
+        params = [athlete_id]
+        if start is not None:
+            query += ' AND date >= ?'
+            params.append(_day(start))
+        if end is not None:
+            query += ' AND date < ?'
+            params.append(_day(end))
+        query += ' ORDER BY date, rowid'
+
+        if connection is None:
+            with closing(self._connect()) as connection:
+                rows = connection.execute(query, params).fetchall()
+        else:
+            rows = connection.execute(query, params).fetchall()
+        if not rows:
+            return RunTable.empty()
+
+        columns = list(zip(*rows))
+        run_types, run_type_codes = np.unique(columns[-1], return_inverse=True)
+        return RunTable(np.array(columns[0], dtype='datetime64[D]'),
+                        *[np.array(values, dtype=np.float64) for values in columns[1:-1]],
+                        run_type_codes.astype(np.int32), run_types.tolist())
+
+    def count(self, athlete_id):
+        with closing(self._connect()) as connection:
+            return connection.execute('SELECT COUNT(*) FROM runs WHERE athlete_id = ?', (athlete_id,)).fetchone()[0]
+
+    def has_runs(self, athlete_id):
+        with closing(self._connect()) as connection:
+            return bool(connection.execute('SELECT EXISTS (SELECT 1 FROM runs WHERE athlete_id = ?)',
+                                           (athlete_id,)).fetchone()[0])
+
+    def fitness(self, athlete_id, today=None):
+        """
+        The athlete's fitness before the current week: the stored checkpoint advanced by the runs
+        it does not hold yet, read as one range scan, and saved again.
+
+        Returns:
+        FitnessCheckpoint: The state load_historic_runs starts the plan from.
+        """
+        self._check_id(athlete_id)
+        today = today or datetime.now()
+        # advance_fitness folds the runs dated up to the current week's Monday
+        week_start = (today - timedelta(days=today.weekday())).date()
+
+        # In a write transaction, so inserts wait until the checkpoint is saved (see insert)
+        with self._transaction() as connection:
+            checkpoint, _ = self.checkpoints.get(athlete_id)
+            # Runs of the checkpoint's last day it does not hold yet are folded too
+            runs = self.window(athlete_id, checkpoint.last_date, week_start + timedelta(days=1), connection)
+            advanced, _ = advance_fitness(checkpoint, runs, today)
+            if advanced != checkpoint:
+                # The runs stay in the store, the checkpoint keeps none as pending
+                self.checkpoints.put(athlete_id, advanced, RunTable.empty())
+        return advanced
@@ -1,11 +1,44 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, g, Response
 from waitress import serve
-from simulateRunPlan import  simulate_training_plan, load_config, format_results
+from simulateRunPlan import  simulate_training_plan, load_config, format_results, get_current_week, \
+    load_physiology_config, load_historical_runs_table, load_historical_runs_stream, RunTable, plan_data, \
+    plan_window, week_checkpoints
+from planCache import ResultCache, plan_cache_key
+from fitnessState import FitnessStateStore
+from calibration import CalibrationStore, calibrate_pace_coefficients
+from planSweep import sweep_training_plans
+from metrics import registry as metrics_registry, stage_timer
+from jobQueue import JobQueue, JobQueueFull
+from planExport import EXPORT_FORMATS, export_rows, iter_plan_rows
+from uploadStore import UPLOAD_STORE_FOLDER, UploadStore
+from runStore import AthleteRuns, RunStore, UnknownAthlete
+from timeline import DEFAULT_TIMELINE_POINTS, TIMELINE_SERIES, daily_timeline, downsample_timeline
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from markupsafe import Markup
+from dataclasses import asdict
 from datetime import datetime
+import gzip
+import logging
+import multiprocessing
 import os
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:  # Responses are gzip-compressed only
+    brotli = None
 
 app = Flask(__name__)
 
+logger = logging.getLogger(__name__)
+
+# Compile the templates once at startup and never check them for changes again
+app.config['TEMPLATES_AUTO_RELOAD'] = False
+for template_name in ('index.html', 'results.html', 'week_plan.html'):
+    app.jinja_env.get_template(template_name)
+
 """
 @app.route('/')
 @app.route('/index')
@@ -21,6 +54,9 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# Uploads are stored under their content hash, see UploadStore
+upload_store = UploadStore(UPLOAD_STORE_FOLDER)
+
 
 def load_input_files():
     if request.method == 'POST':
@@ -36,20 +72,19 @@ def load_input_files():
             return redirect(request.url)
 
         # Check if it's a valid file (CSV or JSON)
-        if file and (file.filename.endswith('.json') or file.filename.endswith('.csv')):
-            filename = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-            file.save(filename)
-
-            if file.filename.endswith('.json'):
-                # Handle JSON file (config)
-                flash(f'Config file "{file.filename}" uploaded successfully.')
-            elif file.filename.endswith('.csv'):
-                # Handle CSV file (historical runs)
-                flash(f'Historical runs file "{file.filename}" uploaded successfully.')
-        else:
-            flash('Invalid file type. Please upload a JSON or CSV file.')
+        try:
+            upload = upload_store.put(file.stream, file.filename)
+        except ValueError as e:
+            flash(str(e))
             return redirect(request.url)
 
+        if upload.kind == 'json':
+            # Handle JSON file (config)
+            flash(f'Config file "{file.filename}" uploaded successfully ({upload.id}).')
+        elif upload.kind == 'csv':
+            # Handle CSV file (historical runs)
+            flash(f'Historical runs file "{file.filename}" uploaded successfully ({upload.id}).')
+
         return render_template('index.html')
 
 
@@ -77,6 +112,220 @@ def calculate_weeks_between(start_date_str, end_date_str):
 
 
 
+# Per-athlete fitness checkpoints for incremental history uploads
+fitness_store = FitnessStateStore()
+
+# Per-athlete pace coefficients fitted from their history
+calibration_store = CalibrationStore()
+
+# Every athlete's runs, imported once through /runs/<athlete_id> instead of sent with each plan
+run_store = RunStore()
+
+# Rendered plans keyed on everything they depend on, see plan_cache_key
+plan_cache = ResultCache(max_entries=256, ttl_seconds=15 * 60)
+
+# Rendered week tables keyed on the week's formatted sessions, shared by all plans
+week_fragment_cache = ResultCache(max_entries=8192, ttl_seconds=60 * 60)
+
+# Simulated plans that are being paged through, so each page only formats and renders its weeks
+simulation_cache = ResultCache(max_entries=32, ttl_seconds=15 * 60)
+
+# Output formats of /generate_plan: the results page, or raw numbers as rows or columns
+PLAN_FORMATS = {'html': 'text/html', 'json': 'application/json', 'columns': 'application/json'}
+
+
+def parse_plan_window(fields):
+    """
+    Paging window of a plan view from 'from_week' (first week number shown) and 'weeks'
+    (number of weeks shown) in a payload or query string.
+
+    Returns:
+    tuple: (from_week, weeks), either may be None; None when neither is given.
+    """
+    from_week, weeks = fields.get('from_week'), fields.get('weeks')
+    if from_week in (None, '') and weeks in (None, ''):
+        return None
+    return (None if from_week in (None, '') else int(from_week),
+            None if weeks in (None, '') else int(weeks))
+
+
+def plan_key(user_params, csv_data, physiology, output_format='html', window=None):
+    """
+    Cache key, also used as the strong ETag, of a rendered plan (of a window of its weeks).
+    None for plans built on a stored athlete checkpoint: they change it, so they always run.
+    """
+    if user_params.get('athlete_id'):
+        return None
+    # Fitness replay cuts history at this Monday, so the calendar week is part of the key too
+    current_week = (get_current_week(user_params['start_date']), datetime.now().isocalendar()[:2])
+    # Stored uploads are keyed by their upload_id in user_params
+    if not isinstance(csv_data, str):
+        csv_data = None
+    variant = None if output_format == 'html' else output_format
+    if window is not None:
+        variant = f"{output_format}:from_week={window[0]}:weeks={window[1]}"
+    return plan_cache_key(user_params, csv_data, asdict(physiology), current_week, variant)
+
+
+def render_plan(user_params, csv_data=None, output_format='html', physiology=None, key=None, window=None):
+    """
+    Simulate, format and render a plan, or return it straight from plan_cache when
+    the same parameters, history, general config and week were already rendered.
+    With a paging window (see parse_plan_window) only its weeks are formatted and rendered,
+    and the simulated plan is kept in simulation_cache for the other pages.
+
+    Returns:
+    str: The results page for 'html', the JSON text for 'json' and 'columns'.
+    """
+    if physiology is None:
+        physiology = load_physiology_config()
+    if key is None:
+        key = plan_key(user_params, csv_data, physiology, output_format, window)
+    if key is None:
+        return render_output(*build_plan(user_params, csv_data), output_format, window)
+
+    body = plan_cache.get(key)
+    if body is None:
+        if window is None:
+            simulated = build_plan(user_params, csv_data, physiology)
+        else:
+            simulation_key = plan_key(user_params, csv_data, physiology, 'simulation')
+            simulated = simulation_cache.get(simulation_key)
+            if simulated is None:
+                simulated = build_plan(user_params, csv_data, physiology)
+                simulation_cache.put(simulation_key, simulated)
+        body = render_output(*simulated, output_format, window)
+        plan_cache.put(key, body)
+    return body
+
+
+def plan_page(training_plan, window):
+    # Which weeks of the plan a paging window shows, sent along with them
+    shown = training_plan[plan_window(training_plan, *window)]
+    return {'from_week': shown[0]['week'] if shown else None, 'weeks': len(shown),
+            'total_weeks': len(training_plan)}
+
+
+def render_output(training_plan, start_date, output_format='html', window=None):
+    if output_format == 'html':
+        return render_results(training_plan, start_date, window)
+    from_week, weeks = window or (None, None)
+    data = plan_data(training_plan, start_date, columnar=output_format == 'columns', from_week=from_week,
+                     weeks=weeks)
+    if window is not None:
+        data['page'] = plan_page(training_plan, window)
+    return app.json.dumps(data)
+
+
+def render_results(training_plan, start_date, window=None):
+    page = None if window is None else plan_page(training_plan, window)
+    from_week, weeks = window or (None, None)
+    training_plan, race_plan, total_time = format_results(training_plan, start_date, from_week, weeks)
+    with stage_timer('template_render'):
+        week_fragments = [render_week(week_data) for week_data in training_plan]
+        return render_template('results.html', week_fragments=week_fragments, race_plan=race_plan,
+                               total_time=total_time, page=page)
+
+
+def render_week(week_data):
+    # Weeks with the same formatted sessions render to the same table, whatever plan they are in
+    key = (week_data['week'], week_data['week_sunday'],
+           tuple(tuple(session.values()) for session in week_data['plan']))
+    html = week_fragment_cache.get(key)
+    if html is None:
+        html = Markup(app.jinja_env.get_template('week_plan.html').render(week_data=week_data))
+        week_fragment_cache.put(key, html)
+    return html
+
+
+# Responses smaller than this are sent as they are
+COMPRESS_MIN_SIZE = 1024
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/plain', 'text/csv', 'application/json', 'application/x-ndjson'}
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Compress rendered pages and JSON with brotli (when installed) or gzip, whichever the
+    client accepts. Streamed downloads are sent as they are.
+    """
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough or
+            'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        encoding = 'br'
+    elif accepted['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    with stage_timer('compression'):
+        response.set_data(brotli.compress(body, quality=5) if encoding == 'br' else gzip.compress(body, 6))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # A strong ETag names one exact representation
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+def request_route():
+    # The URL rule rather than the path, so /metrics does not get one series per URL
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@app.after_request
+def record_request_metrics(response):
+    metrics_registry.observe_request(request_route(), request.method, response.status_code,
+                                     time.perf_counter() - g.request_start)
+    g.request_recorded = True
+    return response
+
+
+@app.teardown_request
+def record_request_failure(exception):
+    # Unhandled exceptions skip after_request
+    if exception is not None and not g.get('request_recorded') and 'request_start' in g:
+        metrics_registry.observe_request(request_route(), request.method, 500,
+                                         time.perf_counter() - g.request_start)
+
+
+@app.errorhandler(UnknownAthlete)
+def unknown_athlete(e):
+    # Plans of an athlete_id with no stored runs, the routes re-raise it past their 400 handlers
+    return jsonify({'error': str(e)}), 404
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Stage timers, per-route latency histograms, request and error counts and plan cache
+    counters in the Prometheus text format.
+    """
+    cache_stats = plan_cache.stats()
+    gauges = {
+        'plan_cache_hits': ("Rendered plans served from the cache.", cache_stats['hits']),
+        'plan_cache_misses': ("Rendered plans not found in the cache.", cache_stats['misses']),
+        'plan_cache_evictions': ("Rendered plans evicted from the cache.", cache_stats['evictions']),
+        'plan_cache_entries': ("Rendered plans held in the cache.", cache_stats['size']),
+        'week_fragment_cache_hits': ("Week tables served from the fragment cache.",
+                                     week_fragment_cache.stats()['hits']),
+        'week_checkpoint_hits': ("Plans resumed from checkpointed weeks.", week_checkpoints.stats()['hits']),
+        'job_queue_pending': ("Jobs queued or running.", job_queue.stats()['pending']),
+    }
+    return Response(metrics_registry.render(gauges), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     #load_input_files()
@@ -90,79 +339,524 @@ def index():
                 'initial_atl': float(request.form['initial_atl']),
                 'initial_ctl': float(request.form['initial_ctl']),
                 'num_weeks': int(request.form['num_weeks']),
-                'initial_long_run_duration': float(request.form['initial_long_run_duration']),
-                'initial_tempo_run_duration': float(request.form['initial_tempo_run_duration']),
-                'initial_long_run_pace': float(request.form['long_run_pace']),
-                'initial_tempo_run_pace': float(request.form['tempo_run_pace']),
+                'long_run_duration': float(request.form['initial_long_run_duration']),
+                'tempo_run_duration': float(request.form['initial_tempo_run_duration']),
+                'long_run_pace': float(request.form['long_run_pace']),
+                'tempo_run_pace': float(request.form['tempo_run_pace']),
                 'start_date': datetime.strptime(request.form['start_date'], '%Y-%m-%d'),
                 'end_date': datetime.strptime(request.form['end_date'], '%Y-%m-%d')
             }
-            start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%d')
-            # Run the simulation using the dictionary object
-            training_plan = generate_plan(user_params)
-            training_plan, race_plan, total_time = format_results(training_plan, start_date)
-
-            # Display the results
-            return render_template('results.html', training_plan=training_plan, race_plan=race_plan , total_time=total_time)
+            # Run the simulation using the dictionary object and display the results
+            return render_plan(user_params)
         except Exception as e:
             return str(e)
 
     # Pre-fill the form with default values from config.json
     return render_template('index.html', config=config)
 
+
+def parse_plan_request(data):
+    """
+    Turn one /generate_plan payload ('config' or 'historical') into simulation inputs.
+
+    Returns:
+    tuple: The user_params dictionary and the historical runs: the CSV text, the RunTable
+    of a stored upload ('upload_id'), the athlete's AthleteRuns in the run store (an
+    'athlete_id' without runs), or None for config plans.
+    """
+    payload = data
+    if data['type'] == 'config':
+
+        #data = data['data']
+        data = data.get('config')
+        if data is None and payload.get('upload_id'):
+            data = upload_store.load_config(payload['upload_id'])
+        # Create a dictionary object to hold all form inputs (with appropriate type casting)
+
+        user_params = {
+            'initial_atl': float(data.get('initial_atl', 0)),
+            'initial_ctl': float(data.get('initial_ctl', 0)),
+            'num_weeks': int(data.get('num_weeks', 0)),
+            'long_run_duration': float(data.get('long_run_duration', 0)),
+            'tempo_run_duration': float(data.get('tempo_run_duration', 0)),
+            'long_run_pace': float(data.get('long_run_pace', 0)),
+            'tempo_run_pace': float(data.get('tempo_run_pace', 0)),
+            'start_date': datetime.strptime(data.get('start_date', '2024-01-01'), '%Y-%m-%d'),
+            'end_date': datetime.strptime(data.get('end_date', '2024-01-01'), '%Y-%m-%d')
+        }
+        #user_params = data['data']
+        return add_optimizer_params(user_params, payload), None
+
+    elif data['type'] == 'historical':
+        csv_data = data.get('csv') or ''
+        if data.get('upload_id'):
+            # Runs of a stored upload, memory-mapped from its pre-parsed sidecar
+            csv_data = upload_store.load_runs(data['upload_id'])
+        start_date = data.get('start_date')
+        end_date = data.get('end_date')
+        num_weeks = calculate_weeks_between(start_date, end_date)
+        user_params = {
+            'start_date': datetime.strptime(start_date, '%Y-%m-%d'),
+            'end_date': datetime.strptime(end_date, '%Y-%m-%d'),
+            'num_weeks': num_weeks
+        }
+        if data.get('upload_id'):
+            user_params['upload_id'] = data['upload_id']
+        if data.get('athlete_id'):
+            # Keep the athlete's fitness checkpoint; with append the CSV only holds new runs
+            user_params['athlete_id'] = str(data['athlete_id'])
+            user_params['append'] = bool(data.get('append', False))
+            if 'csv' not in data and not data.get('upload_id') and not user_params['append']:
+                # No runs sent: plan from the athlete's runs in the run store
+                csv_data = run_store.athlete_runs(user_params['athlete_id'])
+        if data.get('calibrate'):
+            # Fit the pace coefficients to this history (stored for the athlete, if any)
+            if user_params.get('append'):
+                # The fit replays the history from zero fitness, an appended CSV only holds the new runs
+                raise ValueError("calibrate needs the athlete's full history, it cannot be combined with append.")
+            user_params['calibrate'] = True
+        return add_optimizer_params(user_params, data), csv_data
+
+    raise ValueError(f"Unknown plan type: {data['type']}")
+
+
+def add_optimizer_params(user_params, data):
+    # Optional 'optimize' mode: search the weekly durations instead of the 3-up/1-down cycle
+    if data.get('optimize'):
+        user_params['optimize'] = True
+        if data.get('tsb_floor') is not None:
+            user_params['tsb_floor'] = float(data['tsb_floor'])
+    return user_params
+
+
+def build_plan(user_params, csv_data=None, physiology=None, progress=None):
+    """
+    Run the simulation for parameters returned by parse_plan_request.
+    progress is passed on to simulate_training_plan.
+    Athletes are planned with their calibrated pace coefficients when they have them.
+
+    Returns:
+    tuple: The training plan and the start date to format it with.
+    """
+    optimizer_options = {'optimize': user_params.get('optimize', False), 'tsb_floor': user_params.get('tsb_floor'),
+                         'progress': progress}
+    if csv_data is None:
+        # Run the simulation using the dictionary object
+        #training_plan = generate_plan(user_params)
+        training_plan = simulate_training_plan(user_params, physiology=physiology, **optimizer_options)
+        return training_plan, user_params['start_date']
+
+    if isinstance(csv_data, AthleteRuns):
+        # Stored runs: the fitness replay and the past weeks each read only their date range
+        athlete_id = user_params['athlete_id']
+        fitness = run_store.fitness(athlete_id)
+        if user_params.get('calibrate'):
+            calibration_store.calibrate({athlete_id: csv_data.window()}, physiology or load_physiology_config())
+        training_plan = simulate_training_plan(config=user_params, historical_runs=csv_data, physiology=physiology,
+                                               fitness=fitness, coefficients=calibration_store.get(athlete_id),
+                                               **optimizer_options)
+        return training_plan, training_plan[0]['week_sunday']
+
+    if user_params.get('athlete_id'):
+        athlete_id = user_params['athlete_id']
+        runs = csv_data if isinstance(csv_data, RunTable) else load_historical_runs_table(csv_data)
+        fitness, runs = fitness_store.advance(athlete_id, runs, append=user_params['append'])
+        if user_params.get('calibrate'):
+            calibration_store.calibrate({athlete_id: runs}, physiology or load_physiology_config())
+        training_plan = simulate_training_plan(config=user_params, historical_runs=runs, physiology=physiology,
+                                               fitness=fitness, coefficients=calibration_store.get(athlete_id),
+                                               **optimizer_options)
+        return training_plan, training_plan[0]['week_sunday']
+
+    if user_params.get('calibrate'):
+        csv_data = csv_data if isinstance(csv_data, RunTable) else load_historical_runs_table(csv_data)
+        (coefficients, _), = calibrate_pace_coefficients([csv_data], physiology or load_physiology_config())
+        optimizer_options['coefficients'] = coefficients
+
+    #training_plan = simulate_training_plan(historical_runs =data['data'] )
+    training_plan = simulate_training_plan(config=user_params, historical_runs=csv_data, physiology=physiology,
+                                           **optimizer_options)
+    return training_plan, training_plan[0]['week_sunday']
+
+
 @app.route('/generate_plan', methods=['POST'])
 def call_generate_plan():
     try:
         # Get the JSON data sent from the client
         data = request.get_json()
-        if data['type'] == 'config':
+        user_params, csv_data = parse_plan_request(data)
+        output_format = data.get('format') or request.args.get('format', 'html')
+        if output_format not in PLAN_FORMATS:
+            raise ValueError(f"Unknown format: {output_format}")
+        # Optional paging: only the weeks from 'from_week' on, 'weeks' of them, are formatted and sent
+        window = parse_plan_window(data) or parse_plan_window(request.args)
+
+        # Answer conditional requests for an unchanged plan before simulating anything
+        physiology = load_physiology_config()
+        key = plan_key(user_params, csv_data, physiology, output_format, window)
+        # Compressed responses carry the key with their encoding appended, see compress_response
+        matched = None
+        if key is not None:
+            matched = next((f"{key}{suffix}" for suffix in ('', '-gzip', '-br')
+                            if request.if_none_match.contains(f"{key}{suffix}")), None)
+        if matched is not None:
+            # The 304 repeats the ETag of the representation the client holds
+            response = Response(status=304)
+            response.set_etag(matched)
+            response.vary.add('Accept-Encoding')
+        else:
+            body = render_plan(user_params, csv_data, output_format, physiology, key, window)
+            response = Response(body, mimetype=PLAN_FORMATS[output_format])
+            if key is not None:
+                response.set_etag(key)
+        return response
+
+    except UnknownAthlete:
+        raise
+    except Exception as e:
+        # Return an error message to the client in case something goes wrong
+        return jsonify({'error': str(e)}), 400
 
-            #data = data['data']
-            data = data.get('config')
-            # Create a dictionary object to hold all form inputs (with appropriate type casting)
 
-            user_params = {
-                'initial_atl': float(data.get('initial_atl', 0)),
-                'initial_ctl': float(data.get('initial_ctl', 0)),
-                'num_weeks': int(data.get('num_weeks', 0)),
-                'long_run_duration': float(data.get('long_run_duration', 0)),
-                'tempo_run_duration': float(data.get('tempo_run_duration', 0)),
-                'long_run_pace': float(data.get('long_run_pace', 0)),
-                'tempo_run_pace': float(data.get('tempo_run_pace', 0)),
-                'start_date': datetime.strptime(data.get('start_date', '2024-01-01'), '%Y-%m-%d'),
-                'end_date': datetime.strptime(data.get('end_date', '2024-01-01'), '%Y-%m-%d')
-            }
-            #user_params = data['data']
+@app.route('/generate_plan/sweep', methods=['POST'])
+def call_generate_plan_sweep():
+    """
+    What-if exploration: a /generate_plan payload plus a 'grid' of values to try for the
+    parameters in SWEEP_PARAMETERS. Returns one row per combination with the final ATL, CTL,
+    TSB and the predicted race time in minutes, as columns.
+    """
+    try:
+        data = request.get_json()
+        user_params, csv_data = parse_plan_request(data)
+        summary = sweep_training_plans(user_params, data.get('grid', {}), historical_runs=csv_data)
+        return jsonify({'columns': {name: values.tolist() for name, values in summary.items()}})
 
-            # Run the simulation using the dictionary object
-            #training_plan = generate_plan(user_params)
-            training_plan = simulate_training_plan(user_params)
+    except UnknownAthlete:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
 
-            # Format the results
-            start_date = user_params['start_date']
 
-        elif data['type'] == 'historical':
-            csv_data = data.get('csv')
-            start_date = data.get('start_date')
-            end_date = data.get('end_date')
-            num_weeks = calculate_weeks_between(start_date, end_date)
-            user_params = {
-                'start_date': datetime.strptime(start_date, '%Y-%m-%d'),
-                'end_date': datetime.strptime(end_date, '%Y-%m-%d'),
-                'num_weeks': num_weeks
-            }
+@app.route('/generate_plan/timeline', methods=['POST'])
+def call_generate_plan_timeline():
+    """
+    Daily ATL, CTL, TSB and load over history and plan for charts, downsampled with LTTB to
+    'points' samples per series (default DEFAULT_TIMELINE_POINTS). 'series' picks a subset.
+    Athlete checkpoints are not used: the timeline needs the full history, so athletes are
+    only accepted with their runs in the run store.
+    """
+    try:
+        data = request.get_json()
+        user_params, csv_data = parse_plan_request(data)
+        if user_params.get('athlete_id') and not isinstance(csv_data, AthleteRuns):
+            raise ValueError("Timelines are built from the full history, send it without athlete_id.")
+        timeline = daily_timeline(user_params, csv_data)
+        points = int(data.get('points', DEFAULT_TIMELINE_POINTS))
+        series = downsample_timeline(timeline, points, data.get('series', TIMELINE_SERIES))
+        return jsonify({'days': len(timeline['date']), 'series': series})
+
+    except UnknownAthlete:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/calibrate', methods=['POST'])
+def call_calibrate():
+    """
+    Fit and store the pace coefficients of a roster in one batch:
+    {"athletes": [{"id": ..., "csv": ...} or {"id": ..., "upload_id": ...}]}.
+    Later plans with the same athlete_id use them.
+    """
+    try:
+        athletes = request.get_json()['athletes']
+        if not isinstance(athletes, list):
+            raise ValueError("'athletes' must be a list of histories.")
+        histories = {}
+        for entry in athletes:
+            athlete_id = str(entry['id'])
+            if entry.get('upload_id'):
+                histories[athlete_id] = upload_store.load_runs(entry['upload_id'])
+            else:
+                histories[athlete_id] = load_historical_runs_table(entry.get('csv') or '')
+        results = calibration_store.calibrate(histories, load_physiology_config())
+        return jsonify({'results': [{'id': athlete_id, 'coefficients': asdict(coefficients), 'runs': runs}
+                                    for athlete_id, (coefficients, runs) in results.items()]})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
 
-            #training_plan = simulate_training_plan(historical_runs =data['data'] )
-            training_plan = simulate_training_plan(config=user_params, historical_runs=csv_data)
-            start_date = training_plan[0]['week_sunday']
 
-        training_plan, race_plan, total_time = format_results(training_plan, start_date)
+UPLOAD_CHUNK_SIZE = 64 * 1024
 
-        return render_template('results.html', training_plan=training_plan, race_plan=race_plan, total_time=total_time)
+
+@app.route('/upload', methods=['POST'])
+def call_upload():
+    """
+    Store a history CSV or config JSON: a multipart form with one file, or the raw body with
+    the name in ?filename=. Returns its upload_id for the 'upload_id' field of plan requests.
+    Identical content is stored once and its CSV is parsed only the first time.
+    """
+    try:
+        if request.mimetype == 'multipart/form-data':
+            upload = next(iter(request.files.values()), None)
+            if upload is None:
+                raise ValueError("No file part")
+            stored = upload_store.put(upload.stream, upload.filename)
+        else:
+            stored = upload_store.put(request.stream, request.args.get('filename', ''))
+        return jsonify(stored.to_dict()), 200 if stored.duplicate else 201
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/runs/<athlete_id>', methods=['POST'])
+def call_import_runs(athlete_id):
+    """
+    Bulk import an athlete's runs into the run store from a history CSV (plain or gzip): the raw
+    body or a multipart form with one file. ?replace=true replaces the stored runs instead of
+    adding to them. Plans of the athlete then need only 'athlete_id' and the plan dates.
+    """
+    try:
+        if request.mimetype == 'multipart/form-data':
+            upload = next(iter(request.files.values()), None)
+            if upload is None:
+                raise ValueError("No file part")
+            stream = upload.stream
+        else:
+            stream = request.stream
+        replace = request.args.get('replace', 'false').lower() == 'true'
+        runs = load_historical_runs_stream(iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''))
+        inserted = run_store.insert(athlete_id, runs, replace=replace)
+        return jsonify({'athlete_id': athlete_id, 'inserted': inserted, 'runs': run_store.count(athlete_id)}), 201
 
     except Exception as e:
-        # Return an error message to the client in case something goes wrong
         return jsonify({'error': str(e)}), 400
 
+
+@app.route('/generate_plan/upload', methods=['POST'])
+def call_generate_plan_upload():
+    """
+    Historical plan from a streamed CSV upload instead of a CSV string inside JSON.
+    The body is the raw CSV (plain or gzip) or a multipart form with one file; start_date,
+    end_date, athlete_id, append, format and the paging window (from_week, weeks) come from the
+    query string or the form fields.
+    The CSV is parsed chunk by chunk as it is read, so the text is never held in memory at once.
+    """
+    try:
+        if request.mimetype == 'multipart/form-data':
+            # Werkzeug spools large files to disk while parsing the form
+            upload = next(iter(request.files.values()), None)
+            if upload is None:
+                raise ValueError("No file part")
+            stream = upload.stream
+            fields = request.form
+        else:
+            stream = request.stream
+            fields = request.args
+
+        data = {'type': 'historical', 'start_date': fields.get('start_date'), 'end_date': fields.get('end_date'),
+                'athlete_id': fields.get('athlete_id'), 'append': fields.get('append', 'false').lower() == 'true'}
+        user_params, _ = parse_plan_request(data)
+        output_format = fields.get('format', 'html')
+        if output_format not in PLAN_FORMATS:
+            raise ValueError(f"Unknown format: {output_format}")
+        runs = load_historical_runs_stream(iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''))
+
+        return Response(render_output(*build_plan(user_params, runs), output_format, parse_plan_window(fields)),
+                        mimetype=PLAN_FORMATS[output_format])
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/generate_plan/export', methods=['POST'])
+def call_generate_plan_export():
+    """
+    Download plans as CSV, NDJSON or Parquet ('format' in the payload or the query string,
+    CSV by default). The payload is a /generate_plan payload, or {"athletes": [...]} for a
+    roster with an 'id' per athlete. Sessions are streamed as they are exported and the
+    roster is simulated one athlete at a time, so the full output is never held in memory.
+    A single plan that fails is a 400; roster athletes that fail are logged and left out.
+    """
+    try:
+        data = request.get_json()
+        export_format = data.get('format') or request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {export_format}")
+        athletes = data['athletes'] if 'athletes' in data else [data]
+        if not isinstance(athletes, list):
+            raise ValueError("'athletes' must be a list of plan requests.")
+        # Validate every payload before the download starts, errors cannot be reported after
+        plans = [(entry.get('id'), parse_plan_request(entry)) for entry in athletes]
+        if len(plans) == 1:
+            # A single plan is simulated before the download starts, so its errors are reported
+            (athlete_id, (user_params, csv_data)), = plans
+            rows = iter_plan_rows(*build_plan(user_params, csv_data), athlete_id)
+        else:
+            rows = roster_rows(plans)
+        chunks = export_rows(rows, export_format)
+    except UnknownAthlete:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return Response(chunks, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="training_plan.{extension}"'})
+
+
+def roster_rows(plans):
+    # Simulate one athlete at a time while the previous one's rows are being sent; an athlete
+    # failing mid-download can only be left out of the roster
+    for athlete_id, (user_params, csv_data) in plans:
+        try:
+            training_plan, start_date = build_plan(user_params, csv_data)
+        except Exception:
+            logger.exception("Export of the plan of athlete %s failed, skipping it", athlete_id)
+            continue
+        yield from iter_plan_rows(training_plan, start_date, athlete_id)
+
+
+# Process pool shared by batch requests, created on first use. Workers are spawned rather
+# than forked, forking the multithreaded server can copy locks held by other threads.
+batch_executor = None
+batch_executor_lock = threading.Lock()
+
+
+def get_batch_executor():
+    global batch_executor
+    with batch_executor_lock:
+        if batch_executor is None:
+            batch_executor = ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return batch_executor
+
+
+def discard_batch_executor(executor):
+    """
+    Drop a broken process pool so the next batch starts a fresh one.
+    """
+    global batch_executor
+    with batch_executor_lock:
+        if batch_executor is executor:
+            batch_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def is_stateful_batch_entry(data):
+    # Athlete entries read and update the fitness and calibration stores, which only the
+    # server process may touch, workers would race it and leave its caches stale
+    return isinstance(data, dict) and bool(data.get('athlete_id') or data.get('calibrate'))
+
+
+def generate_batch_entry(data):
+    """
+    Simulate and format the plan of one athlete of a batch.
+    Errors are returned with the entry so one bad payload does not fail the whole batch.
+    """
+    athlete_id = data.get('id')
+    try:
+        return {'id': athlete_id, **plan_result(*build_plan(*parse_plan_request(data)))}
+    except Exception as e:
+        return {'id': athlete_id, 'error': str(e)}
+
+
+def plan_result(training_plan, start_date):
+    # A formatted plan as JSON-serializable data instead of HTML
+    training_plan, race_plan, total_time = format_results(training_plan, start_date)
+    return {'training_plan': training_plan, 'race_plan': race_plan, 'total_time': total_time}
+
+
+@app.route('/generate_plan/batch', methods=['POST'])
+def call_generate_plan_batch():
+    try:
+        athletes = request.get_json()['athletes']
+        if not isinstance(athletes, list):
+            raise ValueError("'athletes' must be a list of plan requests.")
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+    executor = get_batch_executor()
+    try:
+        futures = [None if is_stateful_batch_entry(data) else executor.submit(generate_batch_entry, data)
+                   for data in athletes]
+    except BrokenProcessPool:
+        # A worker died in an earlier batch, start over with a fresh pool
+        discard_batch_executor(executor)
+        executor = get_batch_executor()
+        futures = [None if is_stateful_batch_entry(data) else executor.submit(generate_batch_entry, data)
+                   for data in athletes]
+
+    results = []
+    for data, future in zip(athletes, futures):
+        if future is None:
+            results.append(generate_batch_entry(data))
+            continue
+        try:
+            results.append(future.result())
+        except Exception as e:
+            # The worker itself failed (e.g. the payload could not be sent to it)
+            if isinstance(e, BrokenProcessPool):
+                discard_batch_executor(executor)
+            athlete_id = data.get('id') if isinstance(data, dict) else None
+            results.append({'id': athlete_id, 'error': str(e)})
+
+    return jsonify({'results': results})
+
+# Background executor for /jobs, full queues answer 503 instead of tying up server threads
+job_queue = JobQueue(max_workers=2, max_pending=32, result_ttl=10 * 60, max_finished=128)
+
+
+def run_plan_job(data, progress=None):
+    user_params, csv_data = parse_plan_request(data)
+    return plan_result(*build_plan(user_params, csv_data, progress=progress))
+
+
+def run_sweep_job(data, progress=None):
+    user_params, csv_data = parse_plan_request(data)
+    summary = sweep_training_plans(user_params, data.get('grid', {}), historical_runs=csv_data, progress=progress)
+    return {'columns': {name: values.tolist() for name, values in summary.items()}}
+
+
+JOB_KINDS = {'plan': run_plan_job, 'sweep': run_sweep_job}
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Submit a /generate_plan ('kind': 'plan', the default) or /generate_plan/sweep ('kind': 'sweep')
+    payload to run in the background. Answers 202 with the job at once; poll its Location.
+    """
+    try:
+        data = request.get_json()
+        kind = data.get('kind', 'plan')
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        # Reject malformed payloads now rather than in the job
+        parse_plan_request(data)
+        job = job_queue.submit(kind, JOB_KINDS[kind], data)
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    except UnknownAthlete:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(job.to_dict()), 202, {'Location': url_for('get_job', job_id=job.id)}
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Status and progress of a job, with its 'result' once done or its 'error' if it failed.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job: {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+
 if __name__ == "__main__":
     serve(app, host="0.0.0.0", port=8000)
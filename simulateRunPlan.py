@@ -1,11 +1,28 @@
+import bisect
+import codecs
 import json
 import csv
+import logging
 import math
+import os
+import threading
+import time
+import zlib
+from dataclasses import astuple, dataclass, replace
 from io import StringIO
 
+import numpy as np
 
 from datetime import datetime, timedelta
 
+from metrics import registry as metrics_registry, stage_timer
+from planCache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+# Log ATL/CTL/TSB of every simulated week, set PLAN_LOG_WEEKS=0 to turn it off on long plans
+LOG_WEEKLY_PROGRESS = os.environ.get('PLAN_LOG_WEEKS', '1') != '0'
+
 # Constants for ATL and CTL smoothing factors
 ATL_DECAY = 1 - math.exp(-1 / 7)  # Approximate 7-day time constant
 CTL_DECAY = 1 - math.exp(-1 / 42)  # Approximate 42-day time constant
@@ -17,6 +34,52 @@ MAX_TEMPO_RUN_DURATION = 90  # Example value in minutes, to be set from config
 MAX_HEART_RATE = 200  # Example value, to be set from config
 RESTING_HEART_RATE = 60  # Example value, to be set from config
 
+GENERAL_CONFIG_FILENAME = 'general_config.json'
+GENERAL_CONFIG_KEYS = ['PROGRESSIVE_OVERLOAD', 'MAX_LONG_RUN_DURATION', 'MAX_TEMPO_RUN_DURATION',
+                       'MAX_HEART_RATE', 'RESTING_HEART_RATE']
+
+
+@dataclass(frozen=True)
+class PhysiologyConfig:
+    """
+    Values from general_config.json. Immutable, so one instance can be shared by concurrent requests.
+    """
+    progressive_overload: float = PROGRESSIVE_OVERLOAD
+    max_long_run_duration: float = MAX_LONG_RUN_DURATION
+    max_tempo_run_duration: float = MAX_TEMPO_RUN_DURATION
+    max_heart_rate: float = MAX_HEART_RATE
+    resting_heart_rate: float = RESTING_HEART_RATE
+
+    @classmethod
+    def from_dict(cls, general_config):
+        # general_config.json uses the constant names as keys, missing ones keep the defaults
+        return cls(**{key.lower(): general_config[key] for key in GENERAL_CONFIG_KEYS
+                      if general_config.get(key) is not None})
+
+
+DEFAULT_PHYSIOLOGY = PhysiologyConfig()
+
+# filename -> (mtime, PhysiologyConfig) of the last load
+_physiology_configs = {}
+_physiology_configs_lock = threading.Lock()
+
+
+# Function to get the general config, reading the file again only when its mtime changes
+def load_physiology_config(filename=GENERAL_CONFIG_FILENAME):
+    try:
+        mtime = os.stat(filename).st_mtime_ns
+    except FileNotFoundError:
+        print(f"Configuration file {filename} not found.")
+        return DEFAULT_PHYSIOLOGY
+
+    with _physiology_configs_lock:
+        cached = _physiology_configs.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        physiology = PhysiologyConfig.from_dict(load_config(filename))
+        _physiology_configs[filename] = (mtime, physiology)
+        return physiology
+
 
 # Function to update ATL, CTL, and TSB using TRIMP
 def update_fitness_fatigue(atl, ctl, trimp):
@@ -27,6 +90,44 @@ def update_fitness_fatigue(atl, ctl, trimp):
     return atl_new, ctl_new, tsb_new
 
 
+# Largest exponent used when rescaling the decay, keeps keep**-n finite in float64
+_MAX_DECAY_EXPONENT = 300
+
+
+def _decay_scan(loads, decay, start):
+    """
+    Apply x = x * (1 - decay) + load * decay to every load at once.
+    Uses the closed form x[j] = keep**j * (start + decay * sum(keep**-k * load[k])), split into
+    blocks short enough for keep**-k not to overflow; only the carry between blocks is sequential.
+    """
+    keep = 1 - decay
+    block = max(1, int(_MAX_DECAY_EXPONENT / -math.log(keep)))
+    steps = np.arange(1, min(block, len(loads)) + 1)
+    growth = keep ** -steps
+    shrink = keep ** steps
+
+    series = np.empty(len(loads), dtype=np.float64)
+    carry = start
+    for first in range(0, len(loads), block):
+        chunk = loads[first:first + block]
+        size = len(chunk)
+        series[first:first + size] = shrink[:size] * (carry + decay * np.cumsum(chunk * growth[:size]))
+        carry = series[first + size - 1]
+    return series
+
+
+# Function to compute the ATL, CTL and TSB after every TRIMP load in one vectorized pass
+def fitness_series(trimps, atl=0.0, ctl=0.0):
+    """
+    Vectorized equivalent of calling update_fitness_fatigue once per load.
+    Returns three arrays holding ATL, CTL and TSB after each load.
+    """
+    trimp_normalized = np.asarray(trimps, dtype=np.float64) / 100
+    atl_series = _decay_scan(trimp_normalized, ATL_DECAY, atl)
+    ctl_series = _decay_scan(trimp_normalized, CTL_DECAY, ctl)
+    return atl_series, ctl_series, ctl_series - atl_series
+
+
 # Function to calculate the number of weeks between two dates
 def calculate_num_weeks(start_date, end_date):
     if isinstance(start_date, str):
@@ -54,50 +155,88 @@ def calculate_distance(duration_minutes, pace_minutes_per_km):
 
 
 # Function to estimate TRIMP based on duration and average heart rate
-def estimate_trimp(duration_minutes, avg_hr):
-    hr_factor = (avg_hr - RESTING_HEART_RATE) / (MAX_HEART_RATE - RESTING_HEART_RATE)
+def estimate_trimp(duration_minutes, avg_hr, physiology=DEFAULT_PHYSIOLOGY):
+    hr_factor = ((avg_hr - physiology.resting_heart_rate) /
+                 (physiology.max_heart_rate - physiology.resting_heart_rate))
     trimp = duration_minutes * hr_factor
     return trimp
 
 
-# Function to estimate pace based on training load and power
-def estimate_pace(last_pace, atl, ctl, trimp, avg_hr, power):
-    return estimate_pace_trimp(last_pace, atl, ctl, trimp, avg_hr, power)
+@dataclass(frozen=True)
+class PaceCoefficients:
+    """
+    Sensitivities of estimate_pace_trimp, the defaults or fitted to an athlete's history
+    (see calibration.calibrate_pace_coefficients).
+    """
+    k1: float = 0.1  # CTL sensitivity
+    k2: float = 0.1  # ATL sensitivity
+    k3: float = 0.05  # TRIMP sensitivity
+    k5: float = 0.02  # Power sensitivity
+    k6: float = 0.001  # Avg HR sensitivity
+    k0: float = 0.0  # Intercept: pace change per session whatever the load
+
 
+DEFAULT_PACE_COEFFICIENTS = PaceCoefficients()
 
-def estimate_pace_trimp(last_pace, atl, ctl, trimp, avg_hr, power):
-    k1 = 0.1  # CTL sensitivity
-    k2 = 0.1  # ATL sensitivity
-    k3 = 0.05  # TRIMP sensitivity
-    k5 = 0.02  # Power sensitivity
-    k6 = 0.001  # Avg HR sensitivity
 
+# Function to estimate pace based on training load and power
+def estimate_pace(last_pace, atl, ctl, trimp, avg_hr, power, physiology=DEFAULT_PHYSIOLOGY,
+                  coefficients=DEFAULT_PACE_COEFFICIENTS):
+    return estimate_pace_trimp(last_pace, atl, ctl, trimp, avg_hr, power, physiology, coefficients)
+
+
+def estimate_pace_trimp(last_pace, atl, ctl, trimp, avg_hr, power, physiology=DEFAULT_PHYSIOLOGY,
+                        coefficients=DEFAULT_PACE_COEFFICIENTS):
     ctl_scaled = ctl / 50
     atl_scaled = atl / 50
     trimp_scaled = trimp / 100
 
     estimated_pace = (last_pace -
-                      k1 * ctl_scaled +
-                      k2 * atl_scaled +
-                      k3 * trimp_scaled -
-                      k5 * (power / 100) -
-                      k6 * (avg_hr - RESTING_HEART_RATE))
+                      coefficients.k1 * ctl_scaled +
+                      coefficients.k2 * atl_scaled +
+                      coefficients.k3 * trimp_scaled -
+                      coefficients.k5 * (power / 100) -
+                      coefficients.k6 * (avg_hr - physiology.resting_heart_rate) +
+                      coefficients.k0)
+
+    return np.maximum(estimated_pace, last_pace * 0.75)
+
+
+class Session:
+    """
+    One session of a training week, planned or past. Slotted instead of a dict to keep
+    long plans compact; to_dict is only needed where the plan is rendered or serialized.
+    """
+    __slots__ = ('type', 'duration', 'avg_hr', 'avg_power', 'trimp', 'pace', 'distance')
+
+    def __init__(self, type, duration, avg_hr, avg_power, trimp, pace, distance):
+        self.type = type
+        self.duration = duration
+        self.avg_hr = avg_hr
+        self.avg_power = avg_power
+        self.trimp = trimp
+        self.pace = pace
+        self.distance = distance
 
-    return max(estimated_pace, last_pace * 0.75)
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"Session({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
 
 
 # Function to simulate the training week
 def simulate_week(training_plan, atl, ctl):
     total_trimp = 0
     for session in training_plan:
-        trimp = session.get('trimp')
+        trimp = session.trimp
         total_trimp += trimp
         atl, ctl, tsb = update_fitness_fatigue(atl, ctl, trimp)
     return atl, ctl, tsb, total_trimp
 
 
 # Function to adjust durations for progressive overload and easier weeks
-def adjust_duration(week_num, last_week_duration):
+def adjust_duration(week_num, last_week_duration, physiology=DEFAULT_PHYSIOLOGY):
     # Check if last_week_duration is a string and convert to float
     if isinstance(last_week_duration, str):
         try:
@@ -109,73 +248,125 @@ def adjust_duration(week_num, last_week_duration):
     if week_num % 4 == 0:
         new_duration = last_week_duration * 0.7  # Reduce duration by 30% for an easier week
     else:
-        new_duration = last_week_duration * PROGRESSIVE_OVERLOAD
+        new_duration = last_week_duration * physiology.progressive_overload
 
         if ((week_num - 1) % 4 == 0) and (week_num != 1):
-            new_duration = last_week_duration + (PROGRESSIVE_OVERLOAD / 2) * last_week_duration
+            new_duration = last_week_duration + (physiology.progressive_overload / 2) * last_week_duration
 
     return new_duration
 
 
-def calculate_fitness_from_history(historical_runs):
-    total_trimp = 0
-    atl = 0
-    ctl = 0
-    num_runs = len(historical_runs)
-
+@dataclass(frozen=True)
+class FitnessCheckpoint:
+    """
+    Fitness state after replaying a run history: ATL, CTL, the latest long and tempo run,
+    the date of the latest run folded in and the keys (see RunTable.keys) of the runs of that day.
+    """
     #really bad numbers if none given
-    last_run_pace = 10.0  # Default pace if no data
-    last_long_run_pace = 10.0  # Default long run pace
-    last_tempo_run_pace = 10.0  # Default tempo run pace
-    last_long_run_duration = 10  # Default long run duration (in minutes)
-    last_tempo_run_duration = 10  # Default tempo run duration (in minutes)
-
-    today = datetime.now()
+    atl: float = 0.0
+    ctl: float = 0.0
+    last_long_run_pace: float = 10.0  # Default long run pace
+    last_long_run_duration: float = 10  # Default long run duration (in minutes)
+    last_tempo_run_pace: float = 10.0  # Default tempo run pace
+    last_tempo_run_duration: float = 10  # Default tempo run duration (in minutes)
+    last_date: str = None  # 'YYYY-MM-DD', None before any run
+    last_date_runs: tuple = ()  # Keys of the runs folded on last_date, so more runs of that day can follow
+
+    @classmethod
+    def from_dict(cls, saved):
+        # From asdict() loaded back from JSON, where the keys of last_date_runs became lists
+        return cls(**dict(saved, last_date_runs=tuple(tuple(key) for key in saved.get('last_date_runs', ()))))
+
+
+def before_current_week(runs, today=None):
+    # Mask of the runs advance_fitness folds: dated before the current week's Monday
+    today = today or datetime.now()
     week_start = today - timedelta(days=today.weekday())  # Start of the current week (Monday)
-    week_end = week_start + timedelta(days=6)  # End of the current week (Sunday)
+    return runs.date < np.datetime64(week_start, 'us')
 
-    # Loop through each historical run and update ATL and CTL
-    for run in historical_runs:
-        #get Here only from previous week
-        run_date = run['date']
 
-        if run_date < week_start :
-            trimp = run['trimp']
-            atl, ctl, _ = update_fitness_fatigue(atl, ctl, trimp)
-            total_trimp += trimp
+@stage_timer('fitness_replay')
+def advance_fitness(checkpoint, historical_runs, today=None):
+    """
+    Fold the runs dated before the current week's Monday into checkpoint, in file order.
+    Runs of the checkpoint's last day that it already holds are skipped, other runs of that day
+    are folded in. Raises ValueError for a run dated before the checkpoint's last day, since an
+    edited older run needs a full replay from FitnessCheckpoint().
+
+    Returns:
+    tuple: The new checkpoint and a RunTable of the runs left for later (this week's runs).
+    """
+    runs = as_run_table(historical_runs)
+
+    #get Here only from previous week
+    before_this_week = before_current_week(runs, today)
+    folded = runs.take(before_this_week)
+    if checkpoint.last_date is not None and len(folded):
+        if folded.date.min() < np.datetime64(checkpoint.last_date):
+            raise ValueError(f"Run dated before {checkpoint.last_date} is already part of the fitness state. "
+                             f"Send the full history to replay it.")
+        folded = folded.without(checkpoint.last_date_runs)
+    if not len(folded):
+        return checkpoint, runs.take(~before_this_week)
+
+    # Replay the runs at once to get ATL and CTL
+    atl_series, ctl_series, _ = fitness_series(folded.trimp, checkpoint.atl, checkpoint.ctl)
+    last_date = str(folded.date.max())
+    last_date_runs = folded.take(folded.date == folded.date.max()).keys()
+    if last_date == checkpoint.last_date:
+        last_date_runs = [tuple(key) for key in checkpoint.last_date_runs] + last_date_runs
+    updates = {'atl': float(atl_series[-1]), 'ctl': float(ctl_series[-1]), 'last_date': last_date,
+               'last_date_runs': tuple(last_date_runs)}
+
+    # Latest long run and tempo run (in file order) set the starting point of the plan
+    long_runs = np.flatnonzero(folded.run_type_mask('long_run'))
+    if long_runs.size:
+        updates['last_long_run_pace'] = float(folded.pace[long_runs[-1]])
+        updates['last_long_run_duration'] = float(folded.duration[long_runs[-1]])
+    tempo_runs = np.flatnonzero(folded.run_type_mask('tempo_run_1'))
+    if tempo_runs.size:
+        updates['last_tempo_run_pace'] = float(folded.pace[tempo_runs[-1]])
+        updates['last_tempo_run_duration'] = float(folded.duration[tempo_runs[-1]])
+
+    return replace(checkpoint, **updates), runs.take(~before_this_week)
 
-            # Check if the run type is 'long_run' and update long run data accordingly
-            if run.get('run_type') == 'long_run':
-                last_long_run_pace = run['pace']
-                last_long_run_duration = run['duration']
-            elif run.get('run_type') == 'tempo_run_1':
-                last_tempo_run_pace = run['pace']
-                last_tempo_run_duration = run['duration']
 
-    return atl, ctl, last_long_run_pace, last_long_run_duration, last_tempo_run_duration
+def calculate_fitness_from_history(historical_runs):
+    # Only the runs up to this week's Monday are folded (see advance_fitness)
+    today = datetime.now()
+    week_end = (today - timedelta(days=today.weekday())).date() + timedelta(days=1)
+    fitness, _ = advance_fitness(FitnessCheckpoint(), history_window(historical_runs, end=week_end), today)
+    return (fitness.atl, fitness.ctl, fitness.last_long_run_pace, fitness.last_long_run_duration,
+            fitness.last_tempo_run_duration)
 
 
 # Function to generate the weekly training plan
 def generate_weekly_plan(week_num, last_week_long_run_duration, last_week_tempo_run_duration,
-                         last_long_run_pace, last_tempo_run_pace, atl, ctl):
-    long_run_duration = adjust_duration(week_num, last_week_long_run_duration)
-    tempo_run_duration = adjust_duration(week_num, last_week_tempo_run_duration)
+                         last_long_run_pace, last_tempo_run_pace, atl, ctl, physiology=DEFAULT_PHYSIOLOGY,
+                         duration_multiplier=None, coefficients=DEFAULT_PACE_COEFFICIENTS):
+    if duration_multiplier is None:
+        long_run_duration = adjust_duration(week_num, last_week_long_run_duration, physiology)
+        tempo_run_duration = adjust_duration(week_num, last_week_tempo_run_duration, physiology)
+    else:
+        # Schedule chosen by the optimizer instead of the 3-up/1-down cycle
+        long_run_duration = last_week_long_run_duration * duration_multiplier
+        tempo_run_duration = last_week_tempo_run_duration * duration_multiplier
 
-    long_run_duration = min(long_run_duration, MAX_LONG_RUN_DURATION)
-    tempo_run_duration = min(tempo_run_duration, MAX_TEMPO_RUN_DURATION)
+    long_run_duration = np.minimum(long_run_duration, physiology.max_long_run_duration)
+    tempo_run_duration = np.minimum(tempo_run_duration, physiology.max_tempo_run_duration)
 
     avg_power_long_run = 180  # Example value for long run
     avg_power_tempo_run = 220  # Example value for tempo runs
     avg_hr_long_run = 140  # Example average heart rate for long run
     avg_hr_tempo_run = 160  # Example average heart rate for tempo run
 
-    trimp_long_run = estimate_trimp(long_run_duration, avg_hr_long_run)
-    trimp_tempo_run = estimate_trimp(tempo_run_duration, avg_hr_tempo_run)
+    trimp_long_run = estimate_trimp(long_run_duration, avg_hr_long_run, physiology)
+    trimp_tempo_run = estimate_trimp(tempo_run_duration, avg_hr_tempo_run, physiology)
 
     long_run_estimated_pace = estimate_pace(last_long_run_pace, atl, ctl, trimp_long_run, avg_hr_long_run,
-                                            avg_power_long_run)
+                                            avg_power_long_run, physiology, coefficients)
     tempo_run_estimated_pace = estimate_pace(last_tempo_run_pace, atl, ctl, trimp_tempo_run, avg_hr_tempo_run,
-                                             avg_power_tempo_run)
+                                             avg_power_tempo_run, physiology, coefficients)
     tempo_run_2_estimated_pace = long_run_estimated_pace
 
     long_run_distance = calculate_distance(long_run_duration, long_run_estimated_pace)
@@ -183,18 +374,366 @@ def generate_weekly_plan(week_num, last_week_long_run_duration, last_week_tempo_
     tempo_run_2_distance = calculate_distance(tempo_run_duration, tempo_run_2_estimated_pace)
 
     return [
-        {'type': 'long_run', 'duration': long_run_duration, 'avg_hr': avg_hr_long_run,
-         'avg_power': avg_power_long_run, 'trimp': trimp_long_run, 'pace': long_run_estimated_pace,
-         'distance': long_run_distance},
-        {'type': 'tempo_run_1', 'duration': tempo_run_duration, 'avg_hr': avg_hr_tempo_run,
-         'avg_power': avg_power_tempo_run, 'trimp': trimp_tempo_run, 'pace': tempo_run_estimated_pace,
-         'distance': tempo_run_1_distance},
-        {'type': 'tempo_run_2', 'duration': tempo_run_duration, 'avg_hr': avg_hr_tempo_run,
-         'avg_power': avg_power_long_run, 'trimp': trimp_long_run, 'pace': tempo_run_2_estimated_pace,
-         'distance': tempo_run_2_distance},
+        Session('long_run', long_run_duration, avg_hr_long_run, avg_power_long_run, trimp_long_run,
+                long_run_estimated_pace, long_run_distance),
+        Session('tempo_run_1', tempo_run_duration, avg_hr_tempo_run, avg_power_tempo_run, trimp_tempo_run,
+                tempo_run_estimated_pace, tempo_run_1_distance),
+        Session('tempo_run_2', tempo_run_duration, avg_hr_tempo_run, avg_power_long_run, trimp_long_run,
+                tempo_run_2_estimated_pace, tempo_run_2_distance),
     ], long_run_duration, tempo_run_duration
 
-def load_historical_runs_file(filename=None, csvData=None):
+
+HISTORY_FLOAT_COLUMNS = ['vo2max', 'avg_power', 'avg_hr', 'distance', 'trimp']
+
+# Row layout of the binary sidecar of a historical runs file, see save_run_table_sidecar
+RUN_TABLE_DTYPE = np.dtype([('date', 'datetime64[D]'), ('duration', 'f8'), ('pace', 'f8'), ('vo2max', 'f8'),
+                            ('avg_power', 'f8'), ('avg_hr', 'f8'), ('distance', 'f8'), ('trimp', 'f8'),
+                            ('run_type_code', 'i4')])
+
+
+class RunTable:
+    """
+    Columnar view of the historical runs: one typed NumPy array per CSV column.
+    Dates are datetime64[D], durations and paces are minutes as floats and run_type
+    is stored as integer codes into the run_types list.
+    """
+
+    def __init__(self, date, duration, pace, vo2max, avg_power, avg_hr, distance, trimp,
+                 run_type_codes, run_types):
+        self.date = date
+        self.duration = duration
+        self.pace = pace
+        self.vo2max = vo2max
+        self.avg_power = avg_power
+        self.avg_hr = avg_hr
+        self.distance = distance
+        self.trimp = trimp
+        self.run_type_codes = run_type_codes
+        self.run_types = list(run_types)
+
+    def __len__(self):
+        return len(self.date)
+
+    @classmethod
+    def empty(cls):
+        floats = [np.empty(0, dtype=np.float64) for _ in range(7)]
+        return cls(np.empty(0, dtype='datetime64[D]'), *floats, np.empty(0, dtype=np.int32), [])
+
+    @classmethod
+    def from_records(cls, historical_runs):
+        # Build a table from the list of dicts returned by load_historical_runs_memory/file
+        if not historical_runs:
+            return cls.empty()
+        run_types, run_type_codes = np.unique([run['run_type'] for run in historical_runs], return_inverse=True)
+        return cls(
+            np.array([run['date'] for run in historical_runs], dtype='datetime64[D]'),
+            *[np.array([run[key] for run in historical_runs], dtype=np.float64)
+              for key in ['duration', 'pace', 'vo2max', 'avg_power', 'avg_hr', 'distance', 'trimp']],
+            run_type_codes.astype(np.int32), run_types.tolist())
+
+    @classmethod
+    def concat(cls, tables):
+        tables = [table for table in tables if len(table)]
+        if not tables:
+            return cls.empty()
+        run_types = sorted(set().union(*[table.run_types for table in tables]))
+        lookup = {run_type: code for code, run_type in enumerate(run_types)}
+        codes = [np.array([lookup[run_type] for run_type in table.run_types], dtype=np.int32)[table.run_type_codes]
+                 for table in tables]
+        return cls(*[np.concatenate([getattr(table, name) for table in tables])
+                     for name in ['date', 'duration', 'pace', 'vo2max', 'avg_power', 'avg_hr', 'distance', 'trimp']],
+                   np.concatenate(codes), run_types)
+
+    @classmethod
+    def from_structured(cls, rows, run_types):
+        # Columns are views into rows, so a memory-mapped array is not copied
+        return cls(*[rows[name] for name in RUN_TABLE_DTYPE.names], run_types)
+
+    def to_structured(self):
+        rows = np.empty(len(self), dtype=RUN_TABLE_DTYPE)
+        for name in RUN_TABLE_DTYPE.names[:-1]:
+            rows[name] = getattr(self, name)
+        rows['run_type_code'] = self.run_type_codes
+        return rows
+
+    @property
+    def run_type(self):
+        return np.array(self.run_types, dtype=object)[self.run_type_codes]
+
+    def run_type_mask(self, run_type):
+        if run_type not in self.run_types:
+            return np.zeros(len(self), dtype=bool)
+        return self.run_type_codes == self.run_types.index(run_type)
+
+    def take(self, index):
+        # Subset of the table (boolean mask, slice or index array), keeping the categories
+        return RunTable(self.date[index], self.duration[index], self.pace[index], self.vo2max[index],
+                        self.avg_power[index], self.avg_hr[index], self.distance[index], self.trimp[index],
+                        self.run_type_codes[index], self.run_types)
+
+    def keys(self):
+        # One hashable key per run, equal for runs with the same date, type and values (NaN included)
+        columns = [np.where(np.isnan(values), None, values).tolist()
+                   for values in (self.duration, self.pace, self.vo2max, self.avg_power, self.avg_hr,
+                                  self.distance, self.trimp)]
+        return list(zip(self.date.astype('datetime64[D]').astype(str).tolist(), self.run_type.tolist(), *columns))
+
+    def without(self, keys):
+        # The runs whose key (see keys) is not one of keys, e.g. runs sent a second time
+        keys = {tuple(key) for key in keys}
+        if not keys or not len(self):
+            return self
+        # Only runs on the dates of keys can match, so only their keys are built
+        candidates = np.flatnonzero(np.isin(self.date.astype('datetime64[D]'),
+                                            np.array(sorted({key[0] for key in keys}), dtype='datetime64[D]')))
+        keep = np.ones(len(self), dtype=bool)
+        keep[candidates] = [key not in keys for key in self.take(candidates).keys()]
+        return self.take(keep)
+
+    def records(self):
+        # Back to the list of dicts used by load_historical_runs_memory/file
+        run_type = self.run_type
+        return [{
+            'date': datetime.combine(self.date[i].item(), datetime.min.time()),
+            'vo2max': float(self.vo2max[i]),
+            'avg_power': float(self.avg_power[i]),
+            'avg_hr': float(self.avg_hr[i]),
+            'duration': float(self.duration[i]),
+            'pace': float(self.pace[i]),
+            'distance': float(self.distance[i]),
+            'trimp': float(self.trimp[i]),
+            'run_type': run_type[i]
+        } for i in range(len(self))]
+
+
+def as_run_table(historical_runs):
+    if historical_runs is None:
+        return RunTable.empty()
+    if isinstance(historical_runs, RunTable):
+        return historical_runs
+    if hasattr(historical_runs, 'window'):
+        return historical_runs.window()
+    return RunTable.from_records(historical_runs)
+
+
+def history_window(historical_runs, start=None, end=None):
+    """
+    The runs a stage needs, dated from start (inclusive) to end (exclusive).
+    A store of runs (anything with a window(start, end) method, see runStore.AthleteRuns)
+    is queried for just that range; tables and lists are returned whole, the callers
+    filter them by date themselves.
+    """
+    if hasattr(historical_runs, 'window'):
+        return historical_runs.window(start, end)
+    return as_run_table(historical_runs)
+
+
+def _parse_clock_column(values, num_parts):
+    # Parse 'h:mm:ss' (num_parts=3) or 'm:ss' (num_parts=2) strings in bulk into minutes
+    if not values:
+        return np.empty(0, dtype=np.float64)
+    parts = np.array(':'.join(values).split(':'), dtype=np.float64)
+    if parts.size != len(values) * num_parts:
+        expected = 'hh:mm:ss' if num_parts == 3 else 'mm:ss'
+        raise ValueError(f"Invalid time value in historical runs. Expected '{expected}'.")
+    parts = parts.reshape(-1, num_parts)
+    if num_parts == 3:
+        return parts[:, 0] * 60 + parts[:, 1] + parts[:, 2] / 60
+    return parts[:, 0] + parts[:, 1] / 60
+
+
+def _split_csv_columns(csv_text):
+    # Plain exports have no quoting, so the whole text is split at once instead of row by row
+    lines = list(filter(None, csv_text.splitlines()))
+    if not lines:
+        return None, []
+    header = [name.strip().lstrip('\ufeff') for name in lines[0].split(',')]
+    if '"' not in csv_text:
+        fields = ','.join(lines[1:]).split(',') if len(lines) > 1 else []
+        if len(fields) == (len(lines) - 1) * len(header):
+            return header, [fields[i::len(header)] for i in range(len(header))]
+    rows = [row for row in csv.reader(lines[1:]) if row]
+    if any(len(row) != len(header) for row in rows):
+        raise ValueError("Invalid row in historical runs: wrong number of columns.")
+    return header, [list(column) for column in zip(*rows)] if rows else [[] for _ in header]
+
+
+@stage_timer('csv_parse')
+def parse_run_table(csv_text):
+    """
+    Parse historical runs CSV text (header first) into a RunTable.
+    Every column is converted with a single NumPy call instead of once per row.
+    """
+    header, column_values = _split_csv_columns(csv_text)
+    if header is None:
+        return RunTable.empty()
+    columns = dict(zip(header, column_values))
+
+    try:
+        date = np.array(columns['date'], dtype='datetime64[D]')
+        floats = {key: np.array(columns[key], dtype=np.float64) for key in HISTORY_FLOAT_COLUMNS}
+        run_types, run_type_codes = np.unique(np.array(columns['run_type'], dtype=str), return_inverse=True)
+        duration = _parse_clock_column(columns['duration'], 3)
+        pace = _parse_clock_column(columns['pace'], 2)
+    except KeyError as e:
+        raise ValueError(f"Missing column {e} in historical runs.")
+
+    return RunTable(date, duration, pace, floats['vo2max'], floats['avg_power'], floats['avg_hr'],
+                    floats['distance'], floats['trimp'], run_type_codes.astype(np.int32).reshape(-1),
+                    run_types.tolist())
+
+
+def load_historical_runs_table(csvData=None, filename=None):
+    if csvData is None:
+        with open(filename, 'r', encoding='utf-8-sig') as file:
+            csvData = file.read()
+    return parse_run_table(csvData)
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+MAX_STREAM_BYTES = 64 << 20  # CSV size limit of a streamed history, after decompression
+
+
+def csv_stream_bytes(chunks, max_length=1 << 20, max_bytes=MAX_STREAM_BYTES):
+    """
+    The CSV bytes of an iterable of chunks of plain or gzip-compressed CSV. gzip is inflated
+    at most max_length bytes at a time, and ValueError is raised past max_bytes of CSV, so a
+    small compressed upload cannot expand into unbounded memory (a gzip bomb).
+    """
+    decompressor = None
+    head = b''
+    total = 0
+
+    def checked(data):
+        nonlocal total
+        total += len(data)
+        if total > max_bytes:
+            raise ValueError(f"Historical runs are larger than {max_bytes} bytes.")
+        return data
+
+    for chunk in chunks:
+        if head is not None:
+            # gzip is detected from the magic number, so no header is needed from the client
+            head += chunk
+            if len(head) < len(GZIP_MAGIC):
+                continue
+            if head.startswith(GZIP_MAGIC):
+                decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            chunk, head = head, None
+        if decompressor is None:
+            yield checked(chunk)
+            continue
+        while chunk:
+            yield checked(decompressor.decompress(chunk, max_length))
+            chunk = decompressor.unconsumed_tail
+
+    if head:
+        yield checked(head)
+    if decompressor is not None:
+        yield checked(decompressor.flush())
+
+
+def load_historical_runs_stream(chunks, batch_size=1 << 20, max_bytes=MAX_STREAM_BYTES):
+    """
+    Parse historical runs from an iterable of bytes chunks, plain or gzip-compressed CSV,
+    as they arrive. At most batch_size bytes of CSV text are held at a time: every full
+    batch of lines is parsed into a RunTable right away and only the typed arrays are kept.
+    Histories over max_bytes of CSV, or with a line over batch_size, are rejected with ValueError.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    header = None
+    tail = ''
+    lines = []
+    pending_size = 0
+    tables = []
+
+    def flush():
+        nonlocal pending_size
+        if lines:
+            tables.append(parse_run_table(header + '\n' + '\n'.join(lines)))
+            lines.clear()
+        pending_size = 0
+
+    for chunk in csv_stream_bytes(chunks, batch_size, max_bytes):
+        text = tail + decoder.decode(chunk)
+        new_lines = text.split('\n')
+        tail = new_lines.pop()
+        if len(tail) > batch_size:
+            raise ValueError(f"Line of historical runs longer than {batch_size} characters.")
+        if header is None and new_lines:
+            header = new_lines.pop(0).rstrip('\r')
+        lines.extend(new_lines)
+        pending_size += len(text) - len(tail)
+        if pending_size >= batch_size:
+            flush()
+
+    tail += decoder.decode(b'', final=True)
+    if header is None:
+        header, tail = tail.rstrip('\r'), ''
+    if tail:
+        lines.append(tail)
+    if header:
+        flush()
+    return RunTable.concat(tables)
+
+
+def run_table_sidecar_paths(filename):
+    return f"{filename}.runs.npy", f"{filename}.runs.json"
+
+
+def save_run_table_sidecar(table, filename):
+    """
+    Save the parsed runs of filename next to it: the rows as a .npy structured array
+    (RUN_TABLE_DTYPE) and the run_type categories as JSON. Written to a temporary file
+    and swapped in, so readers never see a partial sidecar.
+    """
+    rows_path, types_path = run_table_sidecar_paths(filename)
+    for path, write in ((types_path, lambda f: f.write(json.dumps(table.run_types).encode('utf-8'))),
+                        (rows_path, lambda f: np.save(f, table.to_structured()))):
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            write(f)
+        os.replace(temp_path, path)
+
+
+def load_run_table_sidecar(filename, sidecar=None):
+    """
+    sidecar is the path the sidecar was saved under, filename by default.
+
+    Returns:
+    RunTable: The runs of filename memory-mapped from its sidecar, or None if there is no
+    sidecar or it is older than the file.
+    """
+    rows_path, types_path = run_table_sidecar_paths(sidecar or filename)
+    try:
+        if os.path.exists(filename) and os.path.getmtime(rows_path) < os.path.getmtime(filename):
+            return None
+        with open(types_path, 'r') as f:
+            run_types = json.load(f)
+        rows = np.load(rows_path, mmap_mode='r')
+    except (FileNotFoundError, ValueError):
+        return None
+    if rows.dtype != RUN_TABLE_DTYPE:
+        return None
+    return RunTable.from_structured(rows, run_types)
+
+
+def load_historical_runs_file(filename=None, csvData=None, as_table=False, sidecar=None):
+    """
+    Load historical runs from a CSV file, as a list of dicts or with as_table=True a RunTable.
+    A binary sidecar (see save_run_table_sidecar) is memory-mapped instead of parsing the text;
+    with as_table=True a missing sidecar is written after parsing, for the next load.
+    The sidecar is saved next to the file, or under the path sidecar when given.
+    """
+    if filename and not csvData:
+        table = load_run_table_sidecar(filename, sidecar)
+        if table is None and as_table:
+            table = load_historical_runs_table(filename=filename)
+            save_run_table_sidecar(table, sidecar or filename)
+        if table is not None:
+            return table if as_table else table.records()
+
     if csvData:
         csv_file = StringIO(csvData)
     historical_runs = []
@@ -259,11 +798,19 @@ def load_historical_runs_memory(csvData):
     return historical_runs
 
 
-def load_historic_runs(config, historical_runs):
+def load_historic_runs(config, historical_runs, fitness=None):
     #historical_runs = load_historical_runs_file('historical_runs.csv',historical_runs )
-    historical_runs = load_historical_runs_memory(historical_runs)
-    initial_atl, initial_ctl, last_run_pace, last_long_run_duration, last_tempo_run_duration = calculate_fitness_from_history(
-        historical_runs)
+    if not isinstance(historical_runs, RunTable) and not hasattr(historical_runs, 'window'):
+        historical_runs = load_historical_runs_table(historical_runs)
+    if fitness is None:
+        initial_atl, initial_ctl, last_run_pace, last_long_run_duration, last_tempo_run_duration = calculate_fitness_from_history(
+            historical_runs)
+    else:
+        # State already advanced by the caller from a stored checkpoint
+        initial_atl, initial_ctl = fitness.atl, fitness.ctl
+        last_run_pace = fitness.last_long_run_pace
+        last_long_run_duration = fitness.last_long_run_duration
+        last_tempo_run_duration = fitness.last_tempo_run_duration
     initial_long_run_pace = last_run_pace
     initial_tempo_run_pace = last_run_pace  # Assume same for simplicity
     config = {
@@ -309,14 +856,50 @@ def calculate_week_start_end_dates(start_date, week_num):
     week_end = week_start + timedelta(days=6)
     return week_start, week_end
 
+class RunIndex:
+    """
+    Historical runs bucketed by plan week: run indices sorted by week number (file order
+    within a week), so the runs of one week are found by bisection in O(log n + k).
+    """
+
+    def __init__(self, historical_runs, start_date):
+        if isinstance(start_date, str):
+            start_date = datetime.strptime(start_date, '%Y-%m-%d')
+        self.runs = as_run_table(historical_runs)
+
+        week_length = np.timedelta64(7, 'D')
+        offsets = self.runs.date.astype('datetime64[us]') - np.datetime64(start_date, 'us')
+        weeks = offsets // week_length
+        # A start_date with a time of day leaves a gap after each Sunday that belongs to no week
+        in_week = offsets - weeks * week_length <= np.timedelta64(6, 'D')
+        weeks = np.where(in_week, weeks + 1, np.iinfo(np.int64).min)
+
+        self.order = np.argsort(weeks, kind='stable')
+        self.weeks = weeks[self.order]
+
+    def week_runs(self, week_num):
+        # Indices into self.runs of the runs in week_num
+        first, last = np.searchsorted(self.weeks, [week_num, week_num + 1])
+        return self.order[first:last]
+
+
+@stage_timer('history_merge')
 def add_historical_runs_to_plan(training_plan, start_date, current_week, historical_runs):
     """
     Add historical runs to the training plan for each week from week 1 to the current_week
     based on whether the run date falls within the week.
     """
+    if isinstance(start_date, str):
+        start_date = datetime.strptime(start_date, '%Y-%m-%d')
+    # Runs from the plan start to the end of the current week
+    window_end = calculate_week_start_end_dates(start_date, current_week)[1] + timedelta(days=1)
+    run_index = RunIndex(history_window(historical_runs, start_date, window_end), start_date)
+    runs = run_index.runs
+
     # remove entries before the current week
 
     training_plan = [entry for entry in training_plan if entry['week'] != current_week - 1]
+    plan_weeks = {entry['week']: entry for entry in training_plan}
     # Iterate from week 1 to the current week
     for week_num in range(1, current_week + 1):
         # Calculate the start and end dates for this week
@@ -329,29 +912,32 @@ def add_historical_runs_to_plan(training_plan, start_date, current_week, histori
                 'week_sunday': week_end.strftime('%Y-%m-%d'),  # The end of the week is Sunday
                 'plan': []
             }
+        elif week_num in plan_weeks:
+            week_data = plan_weeks[week_num]
         else:
-            for entry in training_plan:
-                if entry['week'] == week_num:
-                    week_data =  entry
+            # Plan already over, keep this week's runs in their own entry
+            week_data = {
+                'week': week_num,
+                'week_sunday': week_end.strftime('%Y-%m-%d'),
+                'plan': []
+            }
+            training_plan.append(week_data)
 
-        # Filter historical runs that belong to this week based on the run date
-        runs_for_this_week = [
-            run for run in historical_runs
-            if week_start <= run['date'] <= week_end
-        ]
+        # Historical runs that belong to this week based on the run date
+        runs_for_this_week = run_index.week_runs(week_num)
 
         # Add historical runs to the plan for this week
-        for run in runs_for_this_week:
+        for i in runs_for_this_week:
             # Format each run (e.g., duration, pace, etc.)
-            formatted_run = {
-                'type': f"Past Run ({run['run_type']})",
-                'duration': run['duration'],  # Assume duration is already formatted
-                'avg_power': run['avg_power'],
-                'avg_hr': run['avg_hr'],
-                'trimp': round(run['trimp'], 2),
-                'pace': run['pace'],  # Assume pace is already formatted
-                'distance': run['distance']
-            }
+            formatted_run = Session(
+                type=f"Past Run ({runs.run_types[runs.run_type_codes[i]]})",
+                duration=float(runs.duration[i]),  # Assume duration is already formatted
+                avg_hr=float(runs.avg_hr[i]),
+                avg_power=float(runs.avg_power[i]),
+                trimp=round(float(runs.trimp[i]), 2),
+                pace=float(runs.pace[i]),  # Assume pace is already formatted
+                distance=float(runs.distance[i])
+            )
             week_data['plan'].append(formatted_run)
 
         # Append the weekly data to the training plan
@@ -361,19 +947,104 @@ def add_historical_runs_to_plan(training_plan, start_date, current_week, histori
     return training_plan
 
 
+class WeekCheckpoints:
+    """
+    Per-week state of recently simulated plans: each week's sessions and the durations, ATL,
+    CTL and TSB after it, keyed by the inputs every week depends on. end_date and the maximum
+    durations are not part of the key, so a plan that only changes them resumes from the last
+    week that is still valid under the new maxima and simulates only the tail.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=15 * 60):
+        self._cache = ResultCache(max_entries, ttl_seconds)
+
+    @staticmethod
+    def key(config, current_week, physiology, coefficients):
+        return (current_week,
+                *(float(config[name]) for name in ('initial_atl', 'initial_ctl', 'long_run_duration',
+                                                   'tempo_run_duration', 'long_run_pace', 'tempo_run_pace')),
+                physiology.progressive_overload, physiology.max_heart_rate, physiology.resting_heart_rate,
+                astuple(coefficients))
+
+    @staticmethod
+    def _same_cap(duration, old_cap, new_cap):
+        # A duration capped at old_cap is the same under new_cap if the cap did not bind under either
+        return old_cap == new_cap or (duration < old_cap and duration <= new_cap)
+
+    def resume(self, key, physiology):
+        """
+        Returns:
+        list: The checkpointed weeks, from the plan's current week on, up to the first week a
+        change of the maximum durations would alter. Empty when nothing is checkpointed.
+        """
+        entry = self._cache.get(key)
+        if entry is None:
+            return []
+        (max_long, max_tempo), weeks = entry
+        for index, (_, long_run_duration, tempo_run_duration, *_) in enumerate(weeks):
+            if not (self._same_cap(long_run_duration, max_long, physiology.max_long_run_duration) and
+                    self._same_cap(tempo_run_duration, max_tempo, physiology.max_tempo_run_duration)):
+                return weeks[:index]
+        return weeks
+
+    def store(self, key, physiology, weeks):
+        # weeks are (sessions, long run duration, tempo run duration, atl, ctl, tsb, total trimp) tuples
+        self._cache.put(key, ((physiology.max_long_run_duration, physiology.max_tempo_run_duration), weeks))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+# Shared by every plan of the process
+week_checkpoints = WeekCheckpoints()
+
+
+# Planned paces outside this range (min/km) are the pace model extrapolating, not a runner
+PLAUSIBLE_PACE_RANGE = (2.5, 20.0)
+
+
+def plausible_paces(training_plan, pace_range=PLAUSIBLE_PACE_RANGE):
+    paces = [session.pace for week in training_plan for session in week['plan']]
+    return not paces or (pace_range[0] <= min(paces) and max(paces) <= pace_range[1])
+
+
 # Function to simulate the training plan
-def simulate_training_plan(config=None, historical_runs=None):
-    if historical_runs:
+def simulate_training_plan(config=None, historical_runs=None, physiology=None, fitness=None,
+                           duration_multipliers=None, optimize=False, tsb_floor=None, log_weeks=None,
+                           progress=None, coefficients=None, reuse_weeks=True):
+    """
+    Simulate the plan from the current week to end_date.
+    duration_multipliers replaces the 3-up/1-down cycle with one multiplier per simulated week;
+    with optimize=True they are searched for to minimize the predicted race time while TSB
+    stays above tsb_floor (see planSweep.optimize_duration_multipliers); ValueError is raised
+    when no schedule does.
+    log_weeks overrides LOG_WEEKLY_PROGRESS for this plan.
+    progress, when given, is called as progress(weeks done, weeks to simulate) after every week.
+    coefficients are the athlete's fitted PaceCoefficients, the defaults when None; a plan
+    whose fitted paces leave PLAUSIBLE_PACE_RANGE is simulated again with the defaults.
+    With reuse_weeks the weeks of the default schedule are resumed from week_checkpoints
+    where still valid, so changing only end_date or the maximum durations simulates the tail.
+    """
+    plan_inputs = (config, historical_runs, physiology, fitness, duration_multipliers)
+    if historical_runs or fitness is not None:
         #config = general_config = load_config("config.json") #change this to get the start and end date
-        config, historical_runs = load_historic_runs(config, historical_runs)
+        config, historical_runs = load_historic_runs(config, historical_runs, fitness)
 
-    config_filename = 'general_config.json'
-    general_config = load_config(config_filename)
-    keys_to_assign = ['PROGRESSIVE_OVERLOAD', 'MAX_LONG_RUN_DURATION', 'MAX_TEMPO_RUN_DURATION',
-                      'MAX_HEART_RATE', 'RESTING_HEART_RATE']
+    if physiology is None:
+        physiology = load_physiology_config()
 
-    for key in keys_to_assign:
-        globals()[key] = general_config.get(key)
+    if optimize:
+        from planSweep import optimize_duration_multipliers, DEFAULT_TSB_FLOOR
+        tsb_floor = DEFAULT_TSB_FLOOR if tsb_floor is None else tsb_floor
+        optimized = optimize_duration_multipliers(config, physiology, tsb_floor,
+                                                  coefficients=coefficients or DEFAULT_PACE_COEFFICIENTS)
+        if not optimized['feasible']:
+            raise ValueError(f"No training schedule keeps TSB above {tsb_floor} every week while preparing for "
+                             f"{optimized['race_distance']} km, lower tsb_floor or plan without optimize.")
+        duration_multipliers = optimized['multipliers']
 
     training_plan = []
     atl = config['initial_atl']
@@ -389,24 +1060,57 @@ def simulate_training_plan(config=None, historical_runs=None):
     num_weeks = calculate_num_weeks(start_date, end_date)
     current_week = get_current_week(start_date)
 
+    if log_weeks is None:
+        log_weeks = LOG_WEEKLY_PROGRESS
+    log_weeks = log_weeks and logger.isEnabledFor(logging.INFO)
+
+    # Optimized schedules differ week by week, only the default one is checkpointed
+    reuse_weeks = reuse_weeks and duration_multipliers is None
+    resumed, simulated = [], []
+    if reuse_weeks:
+        checkpoint_key = week_checkpoints.key(config, current_week, physiology,
+                                              coefficients or DEFAULT_PACE_COEFFICIENTS)
+        resumed = week_checkpoints.resume(checkpoint_key, physiology)
+
+    simulation_start = time.perf_counter()
     for week in range(current_week, num_weeks + 1):
-        weekly_plan, long_run_duration, tempo_run_duration = generate_weekly_plan(
-            week, last_long_run_duration, last_tempo_run_duration, last_long_run_pace, last_tempo_run_pace, atl, ctl)
+        if week - current_week < len(resumed):
+            weekly_plan, long_run_duration, tempo_run_duration, atl, ctl, tsb, total_trimp = \
+                resumed[week - current_week]
+        else:
+            multiplier = None if duration_multipliers is None else duration_multipliers[week - current_week]
+            weekly_plan, long_run_duration, tempo_run_duration = generate_weekly_plan(
+                week, last_long_run_duration, last_tempo_run_duration, last_long_run_pace, last_tempo_run_pace,
+                atl, ctl, physiology, multiplier, coefficients or DEFAULT_PACE_COEFFICIENTS)
+
+            # Simulate the training week
+            atl, ctl, tsb, total_trimp = simulate_week(weekly_plan, atl, ctl)
+            simulated.append((weekly_plan, long_run_duration, tempo_run_duration, atl, ctl, tsb, total_trimp))
 
+        # A copy, the current week gets this week's past runs appended to it
         training_plan.append({
             'week': week,
-            'plan': weekly_plan
+            'plan': list(weekly_plan)
         })
 
         # Update last run durations and paces for the next week
         last_long_run_duration = long_run_duration
         last_tempo_run_duration = tempo_run_duration
-        last_long_run_pace = weekly_plan[0]['pace']
-        last_tempo_run_pace = weekly_plan[1]['pace']
-
-        # Simulate the training week
-        atl, ctl, tsb, total_trimp = simulate_week(weekly_plan, atl, ctl)
-        print(f"Week {week}: ATL={atl:.2f}, CTL={ctl:.2f}, TSB={tsb:.2f}, Total TRIMP={total_trimp:.2f}")
+        last_long_run_pace = weekly_plan[0].pace
+        last_tempo_run_pace = weekly_plan[1].pace
+
+        if log_weeks:
+            logger.info("Week %d: ATL=%.2f, CTL=%.2f, TSB=%.2f, Total TRIMP=%.2f", week, atl, ctl, tsb, total_trimp)
+        if progress is not None:
+            progress(week - current_week + 1, num_weeks - current_week + 1)
+    metrics_registry.observe_stage('weekly_simulation', time.perf_counter() - simulation_start)
+    if reuse_weeks and simulated:
+        week_checkpoints.store(checkpoint_key, physiology, resumed + simulated)
+
+    if coefficients is not None and not plausible_paces(training_plan):
+        logger.warning("Paces planned with the fitted coefficients are implausible, using the default ones.")
+        return simulate_training_plan(*plan_inputs, optimize=optimize, tsb_floor=tsb_floor, log_weeks=log_weeks,
+                                      progress=progress, reuse_weeks=reuse_weeks)
 
     #Add History
     start_date = config['start_date']
@@ -453,57 +1157,86 @@ def calculate_sunday_date(start_date, week_num):
     return sunday + timedelta(weeks=week_num - 1)
 
 
-def format_results(training_plan, start_date):
+# The race predicted from a plan's last week: a half marathon once its long run and tempo run
+# cover more than HALF_MARATHON_VOLUME km, a 10 km race before that
+HALF_MARATHON_DISTANCE = 21.1
+HALF_MARATHON_VOLUME = 18
+SHORT_RACE_DISTANCE = 10
+
+
+# Function to predict the race from the last week of a plan
+def predict_race(weekly_plan):
+    """
+    Split the race into a slow part at the long run pace (2/3) and a fast part at the tempo pace (1/3).
+    Works on sessions holding scalars or arrays (batched plans).
+
+    Returns:
+    tuple: Slow and fast race distances (km) and times (minutes).
+    """
+    for session in weekly_plan:
+        if session.type == 'long_run':
+            long_run_pace = session.pace
+            long_run_distance = session.distance
+        elif session.type == 'tempo_run_1':
+            tempo_run_pace = session.pace
+            tempo_run_distance = session.distance
+
+    #if enough km to tun half marathon
+    race_distance = np.where((tempo_run_distance + long_run_distance) > HALF_MARATHON_VOLUME,
+                             HALF_MARATHON_DISTANCE, SHORT_RACE_DISTANCE)
+    long_race_distance = (race_distance * 2 / 3)
+    tempo_race_distance = (race_distance * 1 / 3)
+
+    long_race_time = long_race_distance * long_run_pace
+    tempo_race_time = tempo_race_distance * tempo_run_pace
+    return long_race_distance, tempo_race_distance, long_race_time, tempo_race_time
+
+
+def format_week(week_data, start_date):
     """
-    Format the results of the training plan:
+    Format one week of a plan for display:
     - Format distances to two decimal places
     - Format time and pace using format_time function
-    - Add a 'week_sunday' value to each week, which represents the date of that week's Sunday
+    - Add a 'week_sunday' value, which represents the date of that week's Sunday
     """
-    formatted_plan = []
+    formatted_week = {
+        'week': week_data['week'],
+        'week_sunday': calculate_sunday_date(start_date, week_data['week']).strftime('%Y-%m-%d'),
+        # Adding week_sunday
+        'plan': []
+    }
 
-    for week_data in training_plan:
-        formatted_week = {
-            'week': week_data['week'],
-            'week_sunday': calculate_sunday_date(start_date, week_data['week']).strftime('%Y-%m-%d'),
-            # Adding week_sunday
-            'plan': []
+    for session in week_data['plan']:
+        formatted_session = {
+            'type': session.type,
+            'duration': format_time(session.duration, False),  # Format duration using format_time
+            'avg_hr': session.avg_hr,
+            'avg_power': session.avg_power,
+            'trimp': round(session.trimp, 2),  # Round trimp to 2 decimal places
+            'pace': format_time(session.pace, True),  # Format pace using format_time
+            'distance': f"{session.distance:.2f} km"  # Format distance to 2 decimal places
         }
+        formatted_week['plan'].append(formatted_session)
+
+    return formatted_week
 
-        for session in week_data['plan']:
-            formatted_session = {
-                'type': session['type'],
-                'duration': format_time(session['duration'], False),  # Format duration using format_time
-                'avg_hr': session['avg_hr'],
-                'avg_power': session['avg_power'],
-                'trimp': round(session['trimp'], 2),  # Round trimp to 2 decimal places
-                'pace': format_time(session['pace'], True),  # Format pace using format_time
-                'distance': f"{session['distance']:.2f} km"  # Format distance to 2 decimal places
-            }
-            formatted_week['plan'].append(formatted_session)
 
-        formatted_plan.append(formatted_week)
+def format_race(training_plan):
+    """
+    Format the race predicted from the last week of the plan.
 
+    Returns:
+    tuple: The race plan (slow and fast part) and the total time.
+    """
     race_plan = []
     for session in training_plan[-1]['plan']:
-        if session['type'] == 'long_run':
-            long_run_pace = session['pace']
-            long_run_distance = session['distance']
-        elif session['type'] == 'tempo_run_1':
-            tempo_run_pace = session['pace']
-            tempo_run_distance = session['distance']
-
-    #if enough km to tun half marathon
-    if (tempo_run_distance + long_run_distance) >18 :
-        long_race_distance = (21.1 * 2 / 3)
-        tempo_race_distance = (21.1 * 1 / 3)
-    else:
-        long_race_distance = (10 * 2 / 3)
-        tempo_race_distance = (10 * 1 / 3)
-
+        if session.type == 'long_run':
+            long_run_pace = session.pace
+        elif session.type == 'tempo_run_1':
+            tempo_run_pace = session.pace
 
-    long_race_time = long_race_distance * long_run_pace
-    tempo_race_time = tempo_race_distance * tempo_run_pace
+    long_race_distance, tempo_race_distance, long_race_time, tempo_race_time = map(
+        float, predict_race(training_plan[-1]['plan']))
 
     slow_run = {
         "distance": f"{long_race_distance:.2f} km",
@@ -523,7 +1256,121 @@ def format_results(training_plan, start_date):
     race_plan.append(fast_run)
     total_time = {"total_time": format_time(long_race_time + tempo_race_time)}
 
-    return formatted_plan, race_plan, total_time
+    return race_plan, total_time
+
+
+def plan_window(training_plan, from_week=None, weeks=None):
+    """
+    The entries of a plan in a paging window: weeks entries starting at week number
+    from_week (the first week when None), every remaining one when weeks is None.
+
+    Returns:
+    slice: The window as a slice of training_plan.
+    """
+    if weeks is not None and weeks < 1:
+        raise ValueError("weeks must be at least 1.")
+    first = 0
+    if from_week is not None:
+        first = bisect.bisect_left([week_data['week'] for week_data in training_plan], from_week)
+    return slice(first, None if weeks is None else first + weeks)
+
+
+class FormattedPlan:
+    """
+    Read-only sequence of the formatted weeks of a plan (see format_week). A week is formatted
+    the first time it is read, so showing a few weeks of a multi-season plan formats only those.
+    """
+
+    def __init__(self, training_plan, start_date):
+        self.training_plan = training_plan
+        self.start_date = start_date
+        self._weeks = {}
+
+    def __len__(self):
+        return len(self.training_plan)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = range(len(self))[index]  # Negative indices and IndexError as for a list
+        week = self._weeks.get(index)
+        if week is None:
+            week = self._weeks[index] = format_week(self.training_plan[index], self.start_date)
+        return week
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def window(self, from_week=None, weeks=None):
+        # The formatted weeks of a paging window, see plan_window
+        return self[plan_window(self.training_plan, from_week, weeks)]
+
+    def race(self):
+        return format_race(self.training_plan)
+
+
+@stage_timer('format_results')
+def format_results(training_plan, start_date, from_week=None, weeks=None):
+    """
+    Format the results of the training plan: the weeks (see format_week), the race plan and
+    the predicted total time. from_week and weeks limit the formatted weeks to a paging window
+    (see plan_window); the race is always predicted from the last week of the whole plan.
+    """
+    formatted_plan = FormattedPlan(training_plan, start_date)
+    race_plan, total_time = formatted_plan.race()
+    return formatted_plan.window(from_week, weeks), race_plan, total_time
+
+
+def plan_data(training_plan, start_date, columnar=False, decimals=3, from_week=None, weeks=None):
+    """
+    The plan as raw numbers instead of the strings of format_results, for JSON clients:
+    durations and times in minutes, paces in min/km, distances in km, rounded to decimals.
+    With columnar=True weeks, sessions and the race plan are given as one list per field.
+    from_week and weeks limit the weeks to a paging window, as for format_results.
+
+    Returns:
+    dict: 'training_plan', 'race_plan' and 'total_time' (minutes).
+    """
+    def number(value):
+        return round(float(value), decimals)
+
+    window = plan_window(training_plan, from_week, weeks)
+    plan_weeks = []
+    for week_data in training_plan[window]:
+        plan_weeks.append({
+            'week': week_data['week'],
+            'week_sunday': calculate_sunday_date(start_date, week_data['week']).strftime('%Y-%m-%d'),
+            'plan': [{name: value if name == 'type' else number(value) for name, value in session.to_dict().items()}
+                     for session in week_data['plan']]
+        })
+
+    last_week = training_plan[-1]['plan']
+    long_race_distance, tempo_race_distance, long_race_time, tempo_race_time = predict_race(last_week)
+    paces = {session.type: session.pace for session in last_week}
+    race_plan = [
+        {'type': 'Slow Run', 'distance': number(long_race_distance), 'pace': number(paces['long_run']),
+         'time': number(long_race_time)},
+        {'type': 'Fast Run', 'distance': number(tempo_race_distance), 'pace': number(paces['tempo_run_1']),
+         'time': number(tempo_race_time)},
+    ]
+    total_time = number(long_race_time + tempo_race_time)
+
+    if not columnar:
+        return {'training_plan': plan_weeks, 'race_plan': race_plan, 'total_time': total_time}
+
+    sessions = {name: [] for name in ('week',) + Session.__slots__}
+    for week in plan_weeks:
+        for session in week['plan']:
+            sessions['week'].append(week['week'])
+            for name in Session.__slots__:
+                sessions[name].append(session[name])
+    return {
+        'training_plan': {'weeks': {'week': [week['week'] for week in plan_weeks],
+                                    'week_sunday': [week['week_sunday'] for week in plan_weeks]},
+                          'sessions': sessions},
+        'race_plan': {name: [race[name] for race in race_plan] for name in ('type', 'distance', 'pace', 'time')},
+        'total_time': total_time,
+    }
 
 
 # Load configuration data from a JSON file
@@ -541,24 +1388,15 @@ def export_to_csv(training_plan, filename='training_plan.csv'):
     with open(filename, mode='w', newline='') as file:
         writer = csv.writer(file)
         writer.writerow(['Week', 'Type', 'Duration', 'Avg HR', 'Avg Power', 'TRIMP', 'Pace', 'Distance'])
-        for week_num, week in enumerate(training_plan, start=1):
-            for session in week:
-                writer.writerow([week_num, session['type'], session['duration'], session['avg_hr'],
-                                 session['avg_power'], session['trimp'], session['pace'], session['distance']])
+        for week in training_plan:
+            for session in week['plan']:
+                writer.writerow([week['week'], session.type, session.duration, session.avg_hr,
+                                 session.avg_power, session.trimp, session.pace, session.distance])
     print(f"Training plan exported to {filename}.")
 
 
 if __name__ == "__main__":
-    config = {
-        'initial_atl': 100,
-        'initial_ctl': 200,
-        'initial_long_run_duration': 60,
-        'initial_tempo_run_duration': 30,
-        'initial_long_run_pace': 6,
-        'initial_tempo_run_pace': 5,
-        'start_date': '2023-01-01',
-        'end_date': '2024-01-01'
-    }
-
-    training_plan = simulate_training_plan(config)
-    export_to_csv(training_plan)
+    # Batch mode: plan a directory of athletes, see batchPlans.py for the options
+    import sys
+    from batchPlans import main
+    sys.exit(main())
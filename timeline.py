@@ -0,0 +1,121 @@
+from datetime import datetime
+
+import numpy as np
+
+from simulateRunPlan import (as_run_table, calculate_week_start_end_dates, fitness_series, get_current_week,
+                             load_historical_runs_table, load_physiology_config, simulate_training_plan)
+
+# Day of the week (0 is Monday) each planned session is placed on
+PLANNED_SESSION_DAYS = {'tempo_run_1': 1, 'tempo_run_2': 3, 'long_run': 6}
+
+DEFAULT_TIMELINE_POINTS = 500
+MAX_TIMELINE_POINTS = 5000
+
+TIMELINE_SERIES = ('load', 'atl', 'ctl', 'tsb')
+
+
+def daily_timeline(config, historical_runs=None, physiology=None):
+    """
+    ATL, CTL and TSB for every calendar day from the first historical run (or the plan start)
+    to the end of the plan. Past runs count on their own dates. Planned sessions are placed on
+    PLANNED_SESSION_DAYS of their week, from today on. Days without a run decay the load, one
+    update_fitness_fatigue step per day.
+
+    Returns:
+    dict: 'date' (datetime64[D]), and 'load' (the day's TRIMP), 'atl', 'ctl', 'tsb' arrays.
+    """
+    if physiology is None:
+        physiology = load_physiology_config()
+    start_date = config['start_date']
+    if isinstance(start_date, str):
+        start_date = datetime.strptime(start_date, '%Y-%m-%d')
+
+    if isinstance(historical_runs, str):
+        historical_runs = load_historical_runs_table(historical_runs)
+    runs = as_run_table(historical_runs)
+    training_plan = simulate_training_plan(config, runs, physiology)
+    if len(runs):
+        atl, ctl = 0.0, 0.0  # Replayed from the first run, as calculate_fitness_from_history does
+    else:
+        atl, ctl = config['initial_atl'], config['initial_ctl']
+
+    today = np.datetime64(datetime.today(), 'D')
+    current_week = get_current_week(start_date)
+    planned_dates, planned_loads = [], []
+    for week_data in training_plan:
+        if week_data['week'] < current_week:
+            continue
+        week_start = np.datetime64(calculate_week_start_end_dates(start_date, week_data['week'])[0], 'D')
+        for session in week_data['plan']:
+            day = PLANNED_SESSION_DAYS.get(session.type)
+            if day is not None and week_start + day >= today:
+                planned_dates.append(week_start + day)
+                planned_loads.append(float(session.trimp))
+
+    dates = [np.array(planned_dates, dtype='datetime64[D]')]
+    loads = [np.array(planned_loads, dtype=np.float64)]
+    if len(runs):
+        dates.append(runs.date.astype('datetime64[D]'))
+        loads.append(runs.trimp)
+    dates = np.concatenate(dates)
+    loads = np.concatenate(loads)
+
+    plan_end = np.datetime64(calculate_week_start_end_dates(start_date, training_plan[-1]['week'])[1], 'D')
+    first_day = dates.min() if len(runs) else np.datetime64(start_date, 'D')
+    last_day = max(plan_end, dates.max()) if len(dates) else plan_end
+
+    daily_load = np.zeros(int((last_day - first_day) // np.timedelta64(1, 'D')) + 1)
+    np.add.at(daily_load, ((dates - first_day) // np.timedelta64(1, 'D')).astype(np.int64), loads)
+    atl_series, ctl_series, tsb_series = fitness_series(daily_load, atl, ctl)
+    return {'date': first_day + np.arange(len(daily_load)), 'load': daily_load, 'atl': atl_series,
+            'ctl': ctl_series, 'tsb': tsb_series}
+
+
+def lttb_indices(x, y, points):
+    """
+    Largest-Triangle-Three-Buckets downsampling: the indices of the points samples that keep
+    the visual shape of (x, y). First and last samples are always kept.
+    """
+    size = len(y)
+    if points >= size or points < 3:
+        return np.arange(size)
+
+    every = (size - 2) / (points - 2)
+    indices = np.empty(points, dtype=np.int64)
+    indices[0], indices[-1] = 0, size - 1
+    selected = 0
+    for bucket in range(points - 2):
+        # Average of the next bucket is the third corner of the triangle
+        next_start = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, size)
+        next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+
+        start, end = int(bucket * every) + 1, int((bucket + 1) * every) + 1
+        area = np.abs((x[selected] - next_x) * (y[start:end] - y[selected]) -
+                      (x[selected] - x[start:end]) * (next_y - y[selected]))
+        selected = start + int(np.argmax(area))
+        indices[bucket + 1] = selected
+    return indices
+
+
+def downsample_timeline(timeline, points=DEFAULT_TIMELINE_POINTS, series=TIMELINE_SERIES):
+    """
+    Downsample each series of a daily_timeline to at most points samples with LTTB.
+    Every series keeps its own dates, so peaks of each are preserved.
+
+    Returns:
+    dict: {series: {'date': [...], 'value': [...]}} with ISO dates, ready for JSON.
+    """
+    if not 3 <= points <= MAX_TIMELINE_POINTS:
+        raise ValueError(f"points must be between 3 and {MAX_TIMELINE_POINTS}.")
+    unknown = set(series) - set(TIMELINE_SERIES)
+    if unknown:
+        raise ValueError(f"Unknown timeline series: {', '.join(sorted(unknown))}")
+
+    days = (timeline['date'] - timeline['date'][0]).astype(np.float64)
+    downsampled = {}
+    for name in series:
+        indices = lttb_indices(days, timeline[name], points)
+        downsampled[name] = {'date': timeline['date'][indices].astype(str).tolist(),
+                             'value': np.round(timeline[name][indices], 3).tolist()}
+    return downsampled
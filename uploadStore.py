@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import re
+import uuid
+
+from simulateRunPlan import load_historical_runs_file, run_table_sidecar_paths
+
+UPLOAD_STORE_FOLDER = os.path.join('uploads', 'store')  # Folder where uploads are stored by content hash
+
+UPLOAD_KINDS = ('csv', 'json')
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class Upload:
+    """
+    A stored upload: its content hash (the id), kind ('csv' or 'json'), whether the same
+    content was already stored, and the number of runs for histories.
+    """
+
+    def __init__(self, upload_id, kind, duplicate, rows=None):
+        self.id = upload_id
+        self.kind = kind
+        self.duplicate = duplicate
+        self.rows = rows
+
+    def to_dict(self):
+        return {'upload_id': self.id, 'kind': self.kind, 'duplicate': self.duplicate, 'rows': self.rows}
+
+
+class UploadStore:
+    """
+    Content-addressed store for uploaded histories and configs: files are saved under the
+    SHA-256 of their bytes, so identical uploads are stored once and never overwrite each other.
+    Every history gets a pre-parsed binary sidecar, so plans from a stored upload memory-map
+    the runs instead of parsing the CSV again.
+    """
+
+    def __init__(self, folder=UPLOAD_STORE_FOLDER):
+        self.folder = folder
+
+    def path(self, upload_id, kind):
+        if not UPLOAD_ID_PATTERN.match(upload_id or ''):
+            raise ValueError(f"Invalid upload id: {upload_id}")
+        return os.path.join(self.folder, f"{upload_id}.{kind}")
+
+    def put(self, stream, filename):
+        """
+        Store a file read from a binary stream; its kind comes from the filename extension.
+
+        Returns:
+        Upload: The stored upload.
+        """
+        kind = os.path.splitext(filename or '')[1].lower().lstrip('.')
+        if kind not in UPLOAD_KINDS:
+            raise ValueError("Invalid file type. Please upload a JSON or CSV file.")
+
+        os.makedirs(self.folder, exist_ok=True)
+        # Hash while spooling to a temporary file, large uploads are never held in memory
+        temp_path = os.path.join(self.folder, f".{uuid.uuid4().hex}.tmp")
+        digest = hashlib.sha256()
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+            path = self.path(digest.hexdigest(), kind)
+            duplicate = os.path.exists(path)
+            if not duplicate:
+                os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        upload = Upload(digest.hexdigest(), kind, duplicate)
+        try:
+            if kind == 'csv':
+                # Parses the CSV only the first time and writes the sidecar
+                upload.rows = len(self.load_runs(upload.id))
+            else:
+                self.load_config(upload.id)
+        except Exception:
+            if not duplicate:
+                self.remove(upload.id, kind)
+            raise
+        return upload
+
+    def load_runs(self, upload_id):
+        """
+        Returns:
+        RunTable: The runs of a stored history, memory-mapped from its sidecar.
+        """
+        path = self.path(upload_id, 'csv')
+        if not os.path.exists(path):
+            raise ValueError(f"Unknown upload: {upload_id}")
+        return load_historical_runs_file(path, as_table=True)
+
+    def load_config(self, upload_id):
+        path = self.path(upload_id, 'json')
+        try:
+            with open(path, 'r', encoding='utf-8-sig') as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            raise ValueError(f"Unknown upload: {upload_id}")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON upload: {e}")
+        if not isinstance(config, dict):
+            raise ValueError("A config upload must hold a JSON object.")
+        return config
+
+    def remove(self, upload_id, kind):
+        path = self.path(upload_id, kind)
+        for file_path in (path,) + (run_table_sidecar_paths(path) if kind == 'csv' else ()):
+            if os.path.exists(file_path):
+                os.remove(file_path)